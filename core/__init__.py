@@ -3,5 +3,6 @@ Copyright (c) 2022, Zach Lagden
 All rights reserved.
 """
 
-from .client import RickBot
+from .client import RickBot, ShardedRickBot
+from .cluster import ClusterManager
 from .context import Context
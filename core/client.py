@@ -5,79 +5,364 @@ All rights reserved.
 
 import logging
 import os
-import json
-from typing import Optional
-from configparser import ConfigParser
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
+import aiohttp
 import discord
 from discord.ext import commands
 
-from utils import format_time, plural, handle_error
+from utils import format_time, plural, handle_error, ErrorPipeline, Timer, TTLCache
 
+from .cluster import ClusterIPC, LocalHub
+from .config import Config, ConfigError, ConfigManager, config_manager
 from .context import Context
+from .database import Database, OperationStats
+from .extensions import ExtensionLoader, LazyLoader, Manifest, ManifestStore
+from .intents import IntentBudget
+from .metrics import Metrics
+from .outbound import MessageScheduler
+from .prefixes import PrefixManager
+from .recorder import GatewayRecorder
+from .scheduler import JobScheduler
+from .views import ViewRegistry
+from .watcher import ReloadWatcher
+from .web import WebClient
 
 allowed_mentions = discord.AllowedMentions.none()
 allowed_mentions.users = True
 
 log = logging.getLogger("rickbot")
 
-config = ConfigParser()
-config.read('./rickconfig.ini')
+INTERNAL_EXTENSIONS = ("cogs", "owner", "prefixes", "profiler")
+
+
+# Changing these only takes effect after a restart.
+RESTART_KEYS = (
+    "RICK.token", "RICK.intents", "RICK.max_messages", "RICK.chunk_guilds_at_startup",
+    "RICK.lazy_load", "RICK.prefix_cache_size", "RICK.prefix_cache_ttl",
+    "MONGO.", "CACHE.", "WEB.", "CLUSTER.", "OUTBOUND.", "METRICS.", "RECORDER.",
+    "SCHEDULER.lookahead", "SCHEDULER.concurrency",
+)
 
 
 class RickBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, *, ipc: Optional[ClusterIPC] = None, config: Optional[ConfigManager] = None, **options):
+        self.config_manager = config or config_manager
+        config = self.config
+        self.manifests = ManifestStore(f"{config.cache.path}/manifests.json")
+        self.discovered = self.discover_extensions()
+
+        # Only ask discord for what the extensions need, everything else costs memory.
+        self.intent_budget = IntentBudget.from_requests(
+            config.rick,
+            {name: manifest.intents + manifest.metadata.get("intents", []) for name, manifest in self.discovered.items()},
+            {name: manifest.member_cache for name, manifest in self.discovered.items()},
+        )
         super().__init__(
             command_prefix=get_prefix,
             case_insensitive=True,
             strip_after_prefix=True,
             allowed_mentions=allowed_mentions,
-            intents=discord.Intents.all(),
-            help_command=HelpCommand()
+            intents=self.intent_budget.intents,
+            member_cache_flags=self.intent_budget.member_cache_flags,
+            max_messages=config.rick.max_messages,
+            chunk_guilds_at_startup=config.rick.chunk_guilds_at_startup,
+            help_command=HelpCommand(),
+            **options
         )
 
-        self.color = int(config.get("RICK", "color"), 16)
-        self.dot: str = config.get("EMOJIS", "wdot")
+        self.help_cache = HelpCache()
+        self.errors = ErrorPipeline()
+        self.metrics = Metrics.from_config(self, config.metrics)
+        self.views = ViewRegistry.from_config(self, config.views)
+        self.recorder: Optional[GatewayRecorder] = None
+        if config.recorder.enabled:
+            # Before connecting, a replay needs the READY and GUILD_CREATE events.
+            self.recorder = GatewayRecorder.from_config(config.recorder)
+            self.recorder.attach(self._connection)
+
+        self.db = Database.from_config(config.mongo)
+        self.web = WebClient.from_config(config.web)
+        # Every message rick sends is queued per channel here.
+        self.outbound = MessageScheduler.from_config(self, config.outbound)
+        # Reminders and other delayed jobs, stored in self.db.
+        self.scheduler = JobScheduler.from_config(self, config.scheduler)
+        # The pooled session from self.web, every cog should use this one.
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.prefixes = PrefixManager(
+            self,
+            config.rick.prefix,
+            max_size=config.rick.prefix_cache_size,
+            ttl=config.rick.prefix_cache_ttl,
+        )
+
+        # Run for every guild message before the command pre-filter, without a Context.
+        self.message_hooks: List[Callable[[discord.Message], Awaitable]] = []
+        self.message_stats = {
+            "filtered": 0,
+            "dispatched": 0,
+        }
 
         self.loaded = {
             "cogs": [],
             "features": []
         }
+        self.lazy = LazyLoader(self)
+        self.loader = ExtensionLoader(self)
+        self.watcher: Optional[ReloadWatcher] = None
+        self.startup_time: float = 0.0
+        self._startup_reported = False
+
+        # Talks to the other clusters, on its own it is a cluster of one.
+        self.ipc = ipc or LocalHub().endpoints[0]
+        self.register_ipc_handlers()
+
+        # Run after checks and converters and after the command's body, for the metrics.
+        self.before_invoke(self._mark_before_invoke)
+        self.after_invoke(self._mark_after_invoke)
+
+        self.config_manager.subscribe(self.on_config_change)
 
         self.setup()
 
+    @property
+    def config(self) -> Config:
+        return self.config_manager.current
+
+    @property
+    def color(self) -> int:
+        return self.config.rick.color
+
+    @property
+    def dot(self) -> str:
+        return self.config.emojis.wdot
+
+    @property
+    def help_blacklist(self) -> Tuple[str, ...]:
+        return self.config.rick.help_blacklist
+
+    def on_config_change(self, old: Config, new: Config, changed: Set[str]):
+        # Names, colors and emojis all end up in the help pages.
+        self.help_cache.clear()
+
+        if "RICK.prefix" in changed:
+            self.prefixes.set_default(new.rick.prefix)
+
+        self.views.per_guild = new.views.per_guild
+        self.views.total = new.views.total
+        self.scheduler.max_attempts = new.scheduler.max_attempts
+        self.scheduler.retry_delay = new.scheduler.retry_delay
+
+        if "RICK.hot_reload" in changed and self.is_ready():
+            if new.rick.hot_reload and self.watcher is None:
+                self.watcher = ReloadWatcher(self)
+                self.watcher.start()
+            elif not new.rick.hot_reload and self.watcher is not None:
+                self.watcher.stop()
+                self.watcher = None
+
+        restart = sorted(key for key in changed if key.startswith(RESTART_KEYS))
+        if restart:
+            log.warning(f"Restart rick for these config changes to take effect: {', '.join(restart)}")
+
+    def discover_extensions(self) -> Dict[str, Manifest]:
+        found = {
+            f"internal.{name}": self.manifests.get(f"./internal/{name}.py")
+            for name in INTERNAL_EXTENSIONS
+        }
+        for folder in ("cogs", "features"):
+            for file in os.listdir(f"./{folder}"):
+                if file.endswith(".py"):
+                    found[f"{folder}.{file[:-3]}"] = self.manifests.get(f"./{folder}/{file}")
+        return found
+
     def setup(self):
-        self.load_extension("internal.cogs")
+        lazy_load = self.config.rick.lazy_load
 
-        for file in os.listdir("./cogs"):
-            if file.endswith(".py"):
-                self.load_extension(f"cogs.{file[:-3]}")
-                self.loaded["cogs"].append(file[:-3])
+        with Timer() as timer:
+            eager = {}
 
-        for file in os.listdir("./features"):
-            if file.endswith(".py"):
-                self.load_extension(f"features.{file[:-3]}")
-                self.loaded["features"].append(file[:-3])
+            for extension, manifest in self.discovered.items():
+                folder, _, name = extension.partition(".")
+                if folder == "internal" or not (lazy_load and self.lazy.defer(extension, manifest)):
+                    eager[extension] = manifest
+                if folder in self.loaded:
+                    self.loaded[folder].append(name)
 
-        self.config = config
+            self.loader.load(eager)
+            self.manifests.save()
+
+        self.startup_time = timer.time
+        log.info(
+            f"Loaded {len(self.extensions)} extensions and deferred {len(self.lazy.pending)} "
+            f"in {self.startup_time:.2f}s ({'lazy' if lazy_load else 'eager'} loading)"
+        )
+
+    def register_ipc_handlers(self):
+        self.ipc.register("stats", self._ipc_stats)
+        self.ipc.register("load_extension", self._ipc_load_extension)
+        self.ipc.register("reload_extension", self._ipc_reload_extension)
+        self.ipc.register("reload_config", self._ipc_reload_config)
+
+    async def _ipc_stats(self, _payload):
+        return {
+            "shards": sorted(getattr(self, "shards", {0: None})),
+            "guilds": len(self.guilds),
+            "latency": self.latency,
+            "messages": dict(self.message_stats),
+        }
+
+    async def _ipc_load_extension(self, name: str):
+        if name not in self.extensions:
+            self.load_extension(name)
+        return True
+
+    async def _ipc_reload_extension(self, name: str):
+        self.reload_extension(name)
+        return True
+
+    async def _ipc_reload_config(self, _payload) -> List[str]:
+        try:
+            return sorted(self.config_manager.reload())
+        except ConfigError as error:
+            raise RuntimeError(str(error))
+
+    def load_extension(self, name, **kwargs):
+        # Drop the stub commands first when a deferred extension is loaded.
+        self.lazy.discard(name)
+        self.help_cache.clear()
+        return super().load_extension(name, **kwargs)
+
+    def unload_extension(self, name, **kwargs):
+        self.help_cache.clear()
+        return super().unload_extension(name, **kwargs)
+
+    def reload_extension(self, name, **kwargs):
+        self.help_cache.clear()
+        return super().reload_extension(name, **kwargs)
 
     def run(self):
-        super().run(self.config.get("RICK", "token"))
+        super().run(self.config.rick.token)
+
+    async def start(self, *args, **kwargs):
+        self.db.connect()
+        self.session = self.web.connect()
+        self.prefixes.collection = self.db["prefixes"]
+        self.outbound.start()
+        await self.views.start()
+        await self.scheduler.start()
+        await self.metrics.start()
+
+        await self.loader.prepare()
+
+        self.config_manager.install_signal_handler(self.loop)
+
+        if self.config.rick.hot_reload:
+            self.watcher = ReloadWatcher(self)
+            self.watcher.start()
+
+        await super().start(*args, **kwargs)
+
+    async def get_prefix(self, message):
+        # Skips the list copy commands.Bot makes, the cached tuple is used as is.
+        return await get_prefix(self, message)
 
     # Events
     async def on_ready(self):
-        print(f"Logged in as {self.user}.")
+        print(f"Logged in as {self.user}. Extensions were set up in {self.startup_time:.2f}s.")
+        if not self._startup_reported:
+            print(self.loader.report())
+            self._startup_reported = True
+
+            saved_members, saved_presences = self.intent_budget.estimate_saved(self.guilds)
+            log.info(
+                f"Running without the {', '.join(self.intent_budget.disabled) or 'no'} intents, "
+                f"an estimated {saved_members / 1024 / 1024:.1f}MB of members and "
+                f"{saved_presences / 1024 / 1024:.1f}MB of presences aren't cached"
+            )
+
+    async def on_guild_remove(self, guild):
+        self.prefixes.invalidate(guild.id)
 
     async def process_commands(self, message):
-        ctx = await self.get_context(message, cls=Context)
+        with Timer() as timer:
+            ctx = await self.get_context(message, cls=Context)
+        ctx.timings["parse"] = timer.time
         await self.invoke(ctx)
 
+    async def invoke(self, ctx):
+        timings = getattr(ctx, "timings", None)
+        if ctx.command is None or timings is None:
+            return await super().invoke(ctx)
+
+        with Timer() as timer:
+            timings["invoked"] = time.perf_counter()
+            await super().invoke(ctx)
+        self.metrics.record_command(ctx, timings.get("parse", 0.0) + timer.time)
+
+    async def _mark_before_invoke(self, ctx):
+        if hasattr(ctx, "timings"):
+            ctx.timings["before"] = time.perf_counter()
+
+    async def _mark_after_invoke(self, ctx):
+        if hasattr(ctx, "timings"):
+            ctx.timings["after"] = time.perf_counter()
+
+    async def on_socket_event_type(self, event_type):
+        self.metrics.record_event(event_type)
+
+    def add_message_hook(self, func: Callable[[discord.Message], Awaitable]):
+        self.message_hooks.append(func)
+
+    def remove_message_hook(self, func: Callable[[discord.Message], Awaitable]):
+        if func in self.message_hooks:
+            self.message_hooks.remove(func)
+
+    def might_be_command(self, message: discord.Message) -> bool:
+        """
+        A cheap check for whether a message could invoke a command, done before
+        building a Context. Only says no when it is certain.
+        """
+        prefixes = self.prefixes.cached(message.guild.id)
+        if prefixes is None:
+            # Not cached yet, the full path will look the prefixes up and cache them.
+            return True
+
+        content = message.content
+        if not content.startswith(prefixes):
+            return False
+
+        for prefix in prefixes:
+            if content.startswith(prefix):
+                words = content[len(prefix):].split(maxsplit=1)
+                return bool(words) and self.get_command(words[0]) is not None
+        return False
+
     async def on_message(self, message):
         if message.author.bot or message.guild is None or message.webhook_id:
             return
 
+        for hook in self.message_hooks:
+            try:
+                await hook(message)
+            except Exception as error:
+                self.errors.report(error, f"message hook {hook!r}")
+
+        if not self.might_be_command(message):
+            self.message_stats["filtered"] += 1
+            return
+
+        self.message_stats["dispatched"] += 1
         await self.process_commands(message)
 
+    async def on_error(self, event_method, *args, **kwargs):
+        error = sys.exc_info()[1]
+        if error is None:
+            return await super().on_error(event_method, *args, **kwargs)
+        self.errors.report(error, f"event {event_method}")
+
     async def on_command_error(self, ctx, error):
         await handle_error(ctx, error)
         '''
@@ -90,15 +375,66 @@ class RickBot(commands.Bot):
         '''
 
     async def close(self):
-        await self.session.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.config_manager.unsubscribe(self.on_config_change)
+        self.outbound.close()
+        self.views.close()
+        self.scheduler.close()
+        await self.metrics.close()
+        await self.db.close()
+        await self.web.close()
         await super().close()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.errors.close()
+
+
+class ShardedRickBot(RickBot, commands.AutoShardedBot):
+    """
+    RickBot with automatic sharding, the cluster launcher runs one per process.
+    """
+
 
+async def get_prefix(bot, message):
+    return await bot.prefixes.get(message.guild.id if message.guild else None)
 
-def get_prefix(bot, message):
-    return commands.when_mentioned_or(config.get("RICK", "prefix"))(bot, message)
+
+class HelpCache:
+    """
+    Built help pages keyed by prefix, kind and name. Cleared whenever an extension
+    is loaded, unloaded or reloaded, a prefix changes or the config is reloaded.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.pages = TTLCache(max_size)
+        self.renders = OperationStats()
+
+    def get(self, key: tuple) -> Optional[discord.Embed]:
+        return self.pages.get(key)
+
+    def set(self, key: tuple, embed: discord.Embed, render_time: float):
+        self.pages.set(key, embed)
+        self.renders.record(render_time, False)
+
+    def clear(self):
+        self.pages.clear()
+
+    def stats(self) -> dict:
+        return dict(
+            self.pages.stats(),
+            renders=self.renders.count,
+            average_render=self.renders.average,
+            max_render=self.renders.max,
+        )
 
 
 class HelpCommand(commands.HelpCommand):
+    async def prepare_help_command(self, ctx, command=None):
+        # Help has to see every cog, so anything still deferred gets loaded now.
+        ctx.bot.lazy.load_all()
+        await super().prepare_help_command(ctx, command)
+
     @property
     def clean_prefix(self) -> str:
         return self.context.clean_prefix
@@ -152,28 +488,60 @@ class HelpCommand(commands.HelpCommand):
         else:
             return f"`{self.clean_prefix}{command.parent} {command.name} {command.signature}`"
 
+    def get_bot_mapping(self):
+        # Only the cogs are used and the page is usually cached, so skip listing every command.
+        mapping = {cog: [] for cog in self.context.bot.cogs.values()}
+        mapping[None] = []
+        return mapping
+
+    async def send_cached(self, kind: str, name: str, build: Callable[[], discord.Embed]):
+        """
+        Replies with a help page, built once per prefix until an extension or prefix changes.
+        """
+        cache: HelpCache = self.context.bot.help_cache
+        key = (self.clean_prefix, kind, name)
+        embed = cache.get(key)
+        if embed is None:
+            with Timer() as timer:
+                embed = build()
+            cache.set(key, embed, timer.time)
+        await self.context.reply(embed=embed)
+
     async def send_bot_help(self, cogs):
+        await self.send_cached("bot", "", lambda: self.build_bot_help(cogs))
+
+    async def send_command_help(self, command):
+        await self.send_cached("command", command.qualified_name, lambda: self.build_command_help(command))
+
+    async def send_group_help(self, group):
+        await self.send_cached("group", group.qualified_name, lambda: self.build_group_help(group))
+
+    async def send_cog_help(self, cog):
+        await self.send_cached("cog", cog.qualified_name, lambda: self.build_cog_help(cog))
+
+    def build_bot_help(self, cogs) -> discord.Embed:
         bot = self.context.bot
-        embed = discord.Embed(title=config.get("RICK", "name"), color=bot.color)
-        blacklist = json.loads(config.get("RICK", "help_blacklist"))
+        embed = discord.Embed(title=bot.config.rick.name, color=bot.color)
         for cog in cogs.keys():
             if (
                 getattr(cog, "qualified_name", None)
                 and getattr(cog, "_hide_from_help", False) is not True
-                and cog.qualified_name.lower() not in blacklist
+                and cog.qualified_name.lower() not in bot.help_blacklist
             ):
                 embed.add_field(
                     name=cog.qualified_name,
                     value=f"{bot.dot} `{self.clean_prefix}help {cog.qualified_name.lower()}`",
                     inline=False,
                 )
-        await self.context.reply(embed=embed)
+        return embed
 
-    async def send_command_help(self, command):
+    def build_command_help(self, command) -> discord.Embed:
         bot = self.context.bot
-        embed = discord.Embed(title=self.get_command_name(command), color=bot.color)
-        if self.get_command_name(command) != self.get_command_signature(command):
-            embed.add_field(name="Usage:", value=self.get_command_signature(command), inline=False)
+        name = self.get_command_name(command)
+        signature = self.get_command_signature(command)
+        embed = discord.Embed(title=name, color=bot.color)
+        if name != signature:
+            embed.add_field(name="Usage:", value=signature, inline=False)
         if command.help or command.brief:
             embed.add_field(name="Description:", value=command.help or command.brief, inline=False)
         if command.aliases:
@@ -184,9 +552,9 @@ class HelpCommand(commands.HelpCommand):
             )
         if cd := self.command_cooldown(command):
             embed.add_field(name="Rate Limits:", value=cd, inline=False)
-        await self.context.reply(embed=embed)
+        return embed
 
-    async def send_group_help(self, group):
+    def build_group_help(self, group) -> discord.Embed:
         bot = self.context.bot
         formatted = [self.code_block(c.name) for c in group.commands]
         embed = discord.Embed(
@@ -204,15 +572,14 @@ class HelpCommand(commands.HelpCommand):
             )
         if cd := self.command_cooldown(group):
             embed.add_field(name="Rate Limits:", value=cd, inline=False)
-        await self.context.reply(embed=embed)
+        return embed
 
-    async def send_cog_help(self, cog):
+    def build_cog_help(self, cog) -> discord.Embed:
         bot = self.context.bot
         cog_commands = ", ".join(self.code_block(c) for c in cog.get_commands()) or "No Commands."
-        embed = discord.Embed(
+        return discord.Embed(
             title=f"**{cog.qualified_name}**", color=bot.color, description=cog_commands
         )
-        await self.context.reply(embed=embed)
 
     async def send_error_message(self, error):
         bot = self.context.bot
@@ -0,0 +1,311 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import urllib.request
+import uuid
+from multiprocessing.connection import Connection, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .config import Config
+
+log = logging.getLogger("rickbot")
+
+Handler = Callable[[Any], Awaitable[Any]]
+
+
+class ClusterIPC:
+    """
+    One cluster's end of the IPC channel, available as ``bot.ipc``.
+
+    ``broadcast`` runs a registered handler on every cluster, this one included,
+    and returns what each of them returned keyed by cluster id. Messages are
+    plain dicts so they can go through a pipe, handlers must take and return
+    picklable values.
+    """
+
+    def __init__(self, cluster_id: int, cluster_count: int, send: Callable[[dict], None]):
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        self._send = send
+        self._handlers: Dict[str, Handler] = {}
+        self._waiting: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, handler: Handler):
+        self._handlers[name] = handler
+
+    def unregister(self, name: str):
+        self._handlers.pop(name, None)
+
+    async def broadcast(self, name: str, payload: Any = None, *, timeout: float = 10) -> Dict[int, Any]:
+        request_id = uuid.uuid4().hex
+        waiting = self._waiting[request_id] = {
+            "results": {},
+            "done": asyncio.get_event_loop().create_future(),
+        }
+        try:
+            self._send({
+                "op": "broadcast",
+                "id": request_id,
+                "command": name,
+                "payload": payload,
+                "origin": self.cluster_id,
+            })
+            # Whatever answered in time, a cluster that is down or restarting won't.
+            await asyncio.wait_for(asyncio.shield(waiting["done"]), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            del self._waiting[request_id]
+        return waiting["results"]
+
+    def receive(self, message: dict):
+        """
+        Handles a message from the hub, must be called on the bot's loop.
+        """
+        if message["op"] == "command":
+            asyncio.ensure_future(self._run(message))
+
+        elif message["op"] == "reply":
+            waiting = self._waiting.get(message["id"])
+            if waiting is None:
+                return
+            result = message["result"]
+            if message.get("error") is not None:
+                result = RuntimeError(message["error"])
+            waiting["results"][message["cluster"]] = result
+            if len(waiting["results"]) >= self.cluster_count and not waiting["done"].done():
+                waiting["done"].set_result(None)
+
+    async def _run(self, message: dict):
+        reply = {
+            "op": "reply",
+            "id": message["id"],
+            "origin": message["origin"],
+            "cluster": self.cluster_id,
+            "result": None,
+            "error": None,
+        }
+        handler = self._handlers.get(message["command"])
+        try:
+            if handler is None:
+                raise LookupError(f"Cluster {self.cluster_id} has no {message['command']!r} handler.")
+            reply["result"] = await handler(message["payload"])
+        except Exception as error:
+            reply["error"] = f"{type(error).__name__}: {error}"
+        self._send(reply)
+
+
+def route(message: dict, clusters: List[int]) -> List[tuple]:
+    """
+    Where the hub sends a message, as (cluster id, message) pairs.
+    """
+    if message["op"] == "broadcast":
+        command = dict(message, op="command")
+        return [(cluster_id, command) for cluster_id in clusters]
+    if message["op"] == "reply":
+        return [(message["origin"], message)]
+    return []
+
+
+class LocalHub:
+    """
+    An in process stand-in for ``ClusterManager``'s IPC, connects any number of
+    ``ClusterIPC`` ends on the running loop so clusters can be tested without
+    processes or discord. A single bot uses one with one cluster.
+    """
+
+    def __init__(self, cluster_count: int = 1):
+        self.endpoints = [
+            ClusterIPC(cluster_id, cluster_count, self._send)
+            for cluster_id in range(cluster_count)
+        ]
+
+    def _send(self, message: dict):
+        loop = asyncio.get_event_loop()
+        for target, routed in route(message, list(range(len(self.endpoints)))):
+            loop.call_soon(self.endpoints[target].receive, routed)
+
+
+# <--- Processes --->
+
+def split_shards(shard_count: int, cluster_count: int) -> List[List[int]]:
+    per_cluster, extra = divmod(shard_count, cluster_count)
+    ranges, start = [], 0
+    for cluster_id in range(cluster_count):
+        end = start + per_cluster + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+
+def recommended_shards(token: str) -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "RickBot"},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)["shards"]
+
+
+def run_cluster(cluster_id: int, cluster_count: int, shard_ids: List[int], shard_count: int, conn: Connection):
+    """
+    The entry point of a cluster process.
+    """
+    from .client import ShardedRickBot
+
+    bot = ShardedRickBot(
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        ipc=ClusterIPC(cluster_id, cluster_count, conn.send),
+    )
+
+    def pump():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            bot.loop.call_soon_threadsafe(bot.ipc.receive, message)
+
+    threading.Thread(target=pump, name="rick-ipc", daemon=True).start()
+    log.info(f"Cluster {cluster_id} starting with shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    bot.run()
+
+
+class Cluster:
+    def __init__(self, cluster_id: int, shard_ids: List[int]):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+    def send(self, message: dict):
+        try:
+            self.conn.send(message)
+        except (OSError, ValueError, AttributeError):
+            # It's down, the broadcast will time out waiting for it.
+            pass
+
+
+class ClusterManager:
+    """
+    Runs the bot as several processes, each with its own range of shards.
+
+    A cluster that exits is restarted after a delay that doubles each time it
+    dies quickly, and the manager is the hub that passes IPC messages between
+    the clusters.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        cluster_count: int,
+        shard_count: Optional[int] = None,
+        *,
+        restart_delay: float = 5,
+        max_restart_delay: float = 300
+    ):
+        self.token = token
+        self.cluster_count = cluster_count
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self.clusters: List[Cluster] = []
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ClusterManager":
+        return cls(
+            config.rick.token,
+            config.cluster.clusters,
+            config.cluster.shards,
+            restart_delay=config.cluster.restart_delay,
+        )
+
+    def _start(self, cluster: Cluster):
+        parent, child = self._context.Pipe()
+        cluster.conn = parent
+        cluster.process = self._context.Process(
+            target=run_cluster,
+            args=(cluster.cluster_id, len(self.clusters), cluster.shard_ids, self.shard_count, child),
+            name=f"rick-cluster-{cluster.cluster_id}",
+        )
+        cluster.process.start()
+        child.close()
+        cluster.started = time.monotonic()
+
+    def _supervise(self, cluster: Cluster):
+        if cluster.process is None or cluster.process.is_alive() or self._stopping:
+            return
+
+        now = time.monotonic()
+        if not cluster.next_start:
+            uptime = now - cluster.started
+            # Back off while it keeps crashing, start from scratch once it had been up a while.
+            delay = self.restart_delay if uptime > self.max_restart_delay else min(
+                self.restart_delay * 2 ** cluster.restarts, self.max_restart_delay
+            )
+            cluster.restarts = 0 if uptime > self.max_restart_delay else cluster.restarts + 1
+            cluster.next_start = now + delay
+            log.warning(
+                f"Cluster {cluster.cluster_id} exited with code {cluster.process.exitcode}, "
+                f"restarting in {delay:.0f}s"
+            )
+            cluster.conn.close()
+        elif now >= cluster.next_start:
+            cluster.next_start = 0.0
+            self._start(cluster)
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        if self.shard_count is None:
+            self.shard_count = recommended_shards(self.token)
+
+        self.clusters = [
+            Cluster(cluster_id, shard_ids)
+            for cluster_id, shard_ids in enumerate(split_shards(self.shard_count, self.cluster_count))
+        ]
+        log.info(f"Starting {len(self.clusters)} clusters for {self.shard_count} shards")
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for cluster in self.clusters:
+            self._start(cluster)
+
+        while not self._stopping:
+            by_conn = {cluster.conn: cluster for cluster in self.clusters if not cluster.conn.closed}
+            for conn in wait(list(by_conn), timeout=1):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                for target, routed in route(message, [cluster.cluster_id for cluster in self.clusters]):
+                    self.clusters[target].send(routed)
+
+            for cluster in self.clusters:
+                self._supervise(cluster)
+
+        log.info("Stopping clusters")
+        for cluster in self.clusters:
+            if cluster.process is not None and cluster.process.is_alive():
+                cluster.process.terminate()
+        for cluster in self.clusters:
+            if cluster.process is not None:
+                cluster.process.join(timeout=30)
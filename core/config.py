@@ -0,0 +1,380 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import json
+import logging
+import os
+import signal
+import threading
+from configparser import ConfigParser, Error as ParserError
+from dataclasses import MISSING, dataclass, fields
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional, Set, Tuple
+
+log = logging.getLogger("rickbot")
+
+_MISSING = object()
+
+Subscriber = Callable[["Config", "Config", Set[str]], Any]
+
+
+class ConfigError(Exception):
+    """
+    Raised when ``rickconfig.ini`` or an extension's config has an invalid value.
+    """
+
+
+# <--- Sections --->
+
+@dataclass(frozen=True)
+class RickConfig:
+    token: str
+    prefix: str
+    # None until an owner id is filled in, nobody can use the owner commands.
+    owner: Optional[int]
+    color: int
+    name: str
+    logo: str
+    help_blacklist: Tuple[str, ...] = ()
+    lazy_load: bool = False
+    prefix_cache_size: int = 10000
+    prefix_cache_ttl: float = 3600
+    intents: str = "auto"
+    max_messages: Optional[int] = 1000
+    chunk_guilds_at_startup: bool = False
+    hot_reload: bool = False
+
+
+@dataclass(frozen=True)
+class EmojiConfig:
+    wdot: str
+
+
+@dataclass(frozen=True)
+class MongoConfig:
+    uri: str
+    database: str
+    username: str = ""
+    password: str = ""
+    pool_size: int = 100
+    min_pool_size: int = 0
+    cache_ttl: float = 300
+    cache_size: int = 10000
+    negative_cache_ttl: float = 60
+    write_buffer_size: int = 1000
+    write_buffer_interval: float = 5.0
+    backend: str = "mongo"
+
+
+@dataclass(frozen=True)
+class CacheConfig:
+    path: str = "./cache"
+    # In MB.
+    max_size: int = 512
+
+
+@dataclass(frozen=True)
+class WebConfig:
+    limit: int = 100
+    limit_per_host: int = 10
+    dns_ttl: int = 300
+    timeout: float = 30
+    connect_timeout: float = 10
+    cache_size: int = 1024
+    cache_ttl: float = 60
+
+
+@dataclass(frozen=True)
+class ClusterConfig:
+    mode: str = "single"
+    clusters: int = 1
+    # None asks discord how many it recommends.
+    shards: Optional[int] = None
+    restart_delay: float = 5
+
+
+@dataclass(frozen=True)
+class OutboundConfig:
+    # Discord allows 5 messages every 5 seconds in a channel.
+    channel_rate: int = 5
+    channel_per: float = 5.0
+    global_rate: int = 50
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9100
+    loop_lag_interval: float = 0.5
+
+
+@dataclass(frozen=True)
+class RecorderConfig:
+    enabled: bool = False
+    # {time} is replaced with when the recording started.
+    path: str = "./recordings/gateway-{time}.rec"
+    scrub_content: bool = False
+
+
+@dataclass(frozen=True)
+class ViewsConfig:
+    per_guild: int = 25
+    total: int = 1000
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    lookahead: float = 3600
+    concurrency: int = 10
+    max_attempts: int = 3
+    retry_delay: float = 60
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Everything in ``rickconfig.ini`` and ``./configs``, parsed and checked once.
+
+    Extension configs stay strings as rick doesn't know what they mean, they are
+    read only mappings of section to key to value in ``extensions[raw_name]``.
+    ``get`` reads the raw ini values for code written against ConfigParser.
+    """
+
+    rick: RickConfig
+    emojis: EmojiConfig
+    mongo: MongoConfig
+    cache: CacheConfig
+    web: WebConfig
+    cluster: ClusterConfig
+    outbound: OutboundConfig
+    metrics: MetricsConfig
+    recorder: RecorderConfig
+    views: ViewsConfig
+    scheduler: SchedulerConfig
+    extensions: Mapping[str, Mapping[str, Mapping[str, str]]]
+    raw: Mapping[str, Mapping[str, str]]
+
+    def get(self, section: str, option: str, *, fallback: Any = _MISSING) -> Any:
+        try:
+            return self.raw[section][option]
+        except KeyError:
+            if fallback is _MISSING:
+                raise
+            return fallback
+
+    def extension(self, raw_name: str) -> Mapping[str, Mapping[str, str]]:
+        return self.extensions.get(raw_name, MappingProxyType({}))
+
+
+SECTIONS = (
+    ("rick", "RICK", RickConfig),
+    ("emojis", "EMOJIS", EmojiConfig),
+    ("mongo", "MONGO", MongoConfig),
+    ("cache", "CACHE", CacheConfig),
+    ("web", "WEB", WebConfig),
+    ("cluster", "CLUSTER", ClusterConfig),
+    ("outbound", "OUTBOUND", OutboundConfig),
+    ("metrics", "METRICS", MetricsConfig),
+    ("recorder", "RECORDER", RecorderConfig),
+    ("views", "VIEWS", ViewsConfig),
+    ("scheduler", "SCHEDULER", SchedulerConfig),
+)
+
+
+# <--- Parsing --->
+
+def _boolean(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ConfigParser.BOOLEAN_STATES:
+        return ConfigParser.BOOLEAN_STATES[lowered]
+    raise ValueError(f"{value!r} isn't true or false")
+
+
+def _optional_int(value: str) -> Optional[int]:
+    # 0, none and auto all mean "no fixed number".
+    lowered = value.strip().lower()
+    if lowered in ("", "0", "none", "auto"):
+        return None
+    return int(lowered)
+
+
+def _owner(value: str) -> Optional[int]:
+    # "ID" is the placeholder rickconfig.ini ships with.
+    if value.strip().upper() in ("", "ID"):
+        return None
+    return int(value)
+
+
+def _color(value: str) -> int:
+    return int(value, 16)
+
+
+def _blacklist(value: str) -> Tuple[str, ...]:
+    names = json.loads(value)
+    if not isinstance(names, list):
+        raise ValueError("it must be a list")
+    return tuple(str(name).lower() for name in names)
+
+
+CONVERTERS = {
+    int: int,
+    float: float,
+    bool: _boolean,
+    str: str.strip,
+    Optional[int]: _optional_int,
+    Tuple[str, ...]: _blacklist,
+}
+
+# Keys whose type needs more than the annotation says.
+SPECIAL = {
+    ("RICK", "color"): _color,
+    ("RICK", "owner"): _owner,
+}
+
+
+def _section(parser: ConfigParser, name: str, cls: type):
+    values = {}
+    raw = parser[name] if parser.has_section(name) else {}
+
+    for field in fields(cls):
+        if field.name not in raw:
+            if field.default is MISSING:
+                raise ConfigError(f"[{name}] {field.name} is missing from rickconfig.ini")
+            continue
+
+        convert = SPECIAL.get((name, field.name)) or CONVERTERS[field.type]
+        try:
+            values[field.name] = convert(raw[field.name])
+        except (ValueError, TypeError) as error:
+            raise ConfigError(f"[{name}] {field.name} = {raw[field.name]!r} is invalid: {error}") from None
+
+    return cls(**values)
+
+
+def _frozen(parser: ConfigParser) -> Mapping[str, Mapping[str, str]]:
+    return MappingProxyType({
+        section: MappingProxyType(dict(parser[section]))
+        for section in parser.sections()
+    })
+
+
+def load_extension_configs(directory: str) -> Mapping[str, Mapping[str, Mapping[str, str]]]:
+    configs = {}
+    if not os.path.isdir(directory):
+        return MappingProxyType(configs)
+
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith(".ini"):
+            continue
+        parser = ConfigParser()
+        try:
+            parser.read(os.path.join(directory, file))
+        except ParserError as error:
+            raise ConfigError(f"{file} could not be read: {error}") from None
+        configs[file[:-4]] = _frozen(parser)
+    return MappingProxyType(configs)
+
+
+def load_config(path: str = "./rickconfig.ini", extension_dir: str = "./configs") -> Config:
+    parser = ConfigParser()
+    try:
+        if not parser.read(path):
+            raise ConfigError(f"{path} doesn't exist")
+    except ParserError as error:
+        raise ConfigError(f"{path} could not be read: {error}") from None
+
+    sections = {attribute: _section(parser, name, cls) for attribute, name, cls in SECTIONS}
+    return Config(
+        **sections,
+        extensions=load_extension_configs(extension_dir),
+        raw=_frozen(parser),
+    )
+
+
+def diff(old: Config, new: Config) -> Set[str]:
+    """
+    What changed between two configs, as "SECTION.key" and "extensions.raw_name".
+    """
+    changed = set()
+    for attribute, name, cls in SECTIONS:
+        before, after = getattr(old, attribute), getattr(new, attribute)
+        for field in fields(cls):
+            if getattr(before, field.name) != getattr(after, field.name):
+                changed.add(f"{name}.{field.name}")
+
+    for raw_name in set(old.extensions) | set(new.extensions):
+        before = {section: dict(values) for section, values in old.extension(raw_name).items()}
+        after = {section: dict(values) for section, values in new.extension(raw_name).items()}
+        if before != after:
+            changed.add(f"extensions.{raw_name}")
+    return changed
+
+
+# <--- Reloading --->
+
+class ConfigManager:
+    """
+    Holds the current ``Config``, ``bot.config`` is always ``current``.
+
+    ``reload`` parses everything again and only swaps it in if all of it is
+    valid, so nothing ever sees half a config. Subscribers are called with the
+    old config, the new one and the keys that changed.
+    """
+
+    def __init__(self, path: str = "./rickconfig.ini", extension_dir: str = "./configs"):
+        self.path = path
+        self.extension_dir = extension_dir
+        self.current = load_config(path, extension_dir)
+        self.subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Subscriber):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Subscriber):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def reload(self) -> Set[str]:
+        """
+        Returns what changed, raises ``ConfigError`` and keeps the old config if
+        the new one is invalid.
+        """
+        with self._lock:
+            new = load_config(self.path, self.extension_dir)
+            old, self.current = self.current, new
+
+        changed = diff(old, new)
+        if changed:
+            log.info(f"Config reloaded, changed: {', '.join(sorted(changed))}")
+            for callback in list(self.subscribers):
+                try:
+                    callback(old, new, changed)
+                except Exception:
+                    log.exception(f"Config subscriber {callback!r} failed")
+        return changed
+
+    def _reload_from_signal(self):
+        try:
+            self.reload()
+        except ConfigError as error:
+            log.error(f"Config not reloaded: {error}")
+
+    def install_signal_handler(self, loop) -> bool:
+        """
+        Reloads on SIGHUP, returns False where there are no unix signals.
+        """
+        if not hasattr(signal, "SIGHUP"):
+            return False
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self._reload_from_signal)
+        except (NotImplementedError, RuntimeError):
+            return False
+        return True
+
+
+# Parsed once on import, everything shares it.
+config_manager = ConfigManager()
@@ -8,7 +8,7 @@ import datetime
 import discord
 from discord.ext import commands
 
-from utils import Confirm
+from utils import Confirm, ProgressReporter, cb_reply
 
 
 class Context(commands.Context):
@@ -18,6 +18,8 @@ class Context(commands.Context):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # perf_counter marks and durations of the invoke, for bot.metrics.
+        self.timings = {}
 
     @property
     def now(self) -> datetime.datetime:
@@ -31,12 +33,26 @@ class Context(commands.Context):
         kwargs.setdefault("color", self.bot.color)
         return discord.Embed(**kwargs)
 
-    async def reply(self, *args, **kwargs):
-        ref = self.message.to_reference(fail_if_not_exists=False)
-        try:
-            return await self.send(*args, reference=ref, **kwargs)
-        except discord.HTTPException:
-            return await self.send(*args, **kwargs)
+    async def send(self, content=None, **kwargs):
+        message = await self.bot.outbound.send(self.channel, content, **kwargs)
+        if kwargs.get("view") is not None:
+            self.bot.views.track(kwargs["view"], message)
+        return message
+
+    async def reply(self, content=None, **kwargs):
+        # The reply is checked before sending instead of retrying without it when it fails.
+        message = await self.bot.outbound.send(self.channel, content, reference=self.message, **kwargs)
+        if kwargs.get("view") is not None:
+            self.bot.views.track(kwargs["view"], message)
+        return message
+
+    async def progress(self, content: str, *, interval: float = 1.5) -> ProgressReporter:
+        """
+        Replies with a status message and returns a reporter that edits it,
+        at most once every ``interval`` seconds.
+        """
+        message = await cb_reply(self, content)
+        return ProgressReporter(message, interval=interval, is_deleted=self.bot.outbound.is_deleted)
 
     async def confirm(
         self,
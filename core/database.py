@@ -0,0 +1,777 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import copy
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils import TTLCache, plural
+
+from .config import MongoConfig
+
+log = logging.getLogger("rickbot")
+
+SortSpec = Sequence[Tuple[str, int]]
+
+# Cached in place of a document that doesn't exist.
+MISSING = object()
+
+
+class OperationStats:
+    __slots__ = ("count", "errors", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, taken: float, failed: bool):
+        self.count += 1
+        self.total += taken
+        if taken > self.max:
+            self.max = taken
+        if failed:
+            self.errors += 1
+
+
+def _document_id(filter: Optional[dict]) -> Tuple[bool, Any]:
+    # Whether a filter targets exactly one document by its id, and that id.
+    if filter and len(filter) == 1 and "_id" in filter and not isinstance(filter["_id"], dict):
+        return True, filter["_id"]
+    return False, None
+
+
+class Collection:
+    """
+    A collection of the bot's database, every operation is timed.
+
+    With ``enable_cache`` reads by ``_id`` are served from memory, including
+    documents that don't exist, and writes through this collection invalidate
+    what they touch. Writes made some other way aren't seen until the entry expires.
+    """
+
+    def __init__(self, database: "Database", name: str):
+        self.database = database
+        self.name = name
+        self.stats: Dict[str, OperationStats] = {}
+
+        self.cache: Optional[TTLCache] = None
+        self.negative_ttl: Optional[float] = None
+
+        # Bumped by writes while a read of the document is in flight, [generation, readers].
+        self._generations: Dict[Hashable, List[int]] = {}
+        # Bumped when every document is invalidated.
+        self._cleared = 0
+
+    def enable_cache(
+        self,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        *,
+        negative_ttl: Optional[float] = None
+    ) -> "Collection":
+        defaults = self.database.cache_defaults
+        self.cache = TTLCache(
+            max_entries if max_entries is not None else defaults["max_entries"],
+            ttl if ttl is not None else defaults["ttl"],
+        )
+        self.negative_ttl = negative_ttl if negative_ttl is not None else defaults["negative_ttl"]
+        return self
+
+    def disable_cache(self):
+        self.cache = None
+
+    def _invalidate(self, filter: Optional[dict]):
+        if self.cache is None:
+            return
+        by_id, document_id = _document_id(filter)
+        if by_id:
+            self._forget(document_id)
+        else:
+            # Can't tell which documents a query touches, so forget all of them.
+            self._cleared += 1
+            self.cache.clear()
+
+    def _forget(self, document_id: Hashable):
+        self.cache.invalidate(document_id)
+        generation = self._generations.get(document_id)
+        if generation is not None:
+            # A read that started before this write mustn't cache what it found.
+            generation[0] += 1
+
+    async def get(self, document_id: Hashable) -> Optional[dict]:
+        """
+        Fetches a document by its ``_id``, through the cache when it is enabled.
+        """
+        return await self.find_one({"_id": document_id})
+
+    @property
+    def raw(self):
+        """
+        The backend collection, a motor collection unless the memory backend is used.
+        """
+        return self.database.raw[self.name]
+
+    @contextmanager
+    def _timed(self, operation: str):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            stats = self.stats.get(operation)
+            if stats is None:
+                stats = self.stats[operation] = OperationStats()
+            stats.record(time.perf_counter() - start, failed)
+
+    async def find_one(self, filter: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        by_id, document_id = _document_id(filter)
+        if self.cache is None or not by_id or projection is not None:
+            with self._timed("find_one"):
+                return await self.raw.find_one(filter, projection)
+
+        document = self.cache.get(document_id, None)
+        if document is None:
+            generation = self._generations.setdefault(document_id, [0, 0])
+            generation[1] += 1
+            started, cleared = generation[0], self._cleared
+            try:
+                with self._timed("find_one"):
+                    found = await self.raw.find_one(filter)
+            finally:
+                generation[1] -= 1
+                if not generation[1]:
+                    del self._generations[document_id]
+
+            # Only cached if nothing wrote to the document while it was read.
+            fresh = generation[0] == started and self._cleared == cleared and self.cache is not None
+            if found is None:
+                if fresh:
+                    self.cache.set(document_id, MISSING, self.negative_ttl)
+                return None
+            if fresh:
+                self.cache.set(document_id, found)
+            document = found
+
+        # Copied so callers can't change what is cached.
+        return None if document is MISSING else copy.deepcopy(document)
+
+    async def find(
+        self,
+        filter: Optional[dict] = None,
+        *,
+        sort: Optional[SortSpec] = None,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Optional[dict] = None
+    ) -> List[dict]:
+        with self._timed("find"):
+            cursor = self.raw.find(filter or {}, projection)
+            if sort:
+                cursor = cursor.sort(list(sort))
+            if skip:
+                cursor = cursor.skip(skip)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list(length=limit or None)
+
+    async def count_documents(self, filter: Optional[dict] = None) -> int:
+        with self._timed("count_documents"):
+            return await self.raw.count_documents(filter or {})
+
+    async def insert_one(self, document: dict):
+        with self._timed("insert_one"):
+            result = await self.raw.insert_one(document)
+        if self.cache is not None:
+            self._forget(result.inserted_id)
+        return result
+
+    async def update_one(self, filter: dict, update: dict, *, upsert: bool = False):
+        try:
+            with self._timed("update_one"):
+                return await self.raw.update_one(filter, update, upsert=upsert)
+        finally:
+            self._invalidate(filter)
+
+    async def update_many(self, filter: dict, update: dict, *, upsert: bool = False):
+        try:
+            with self._timed("update_many"):
+                return await self.raw.update_many(filter, update, upsert=upsert)
+        finally:
+            self._invalidate(filter)
+
+    async def delete_one(self, filter: dict):
+        try:
+            with self._timed("delete_one"):
+                return await self.raw.delete_one(filter)
+        finally:
+            self._invalidate(filter)
+
+    async def delete_many(self, filter: dict):
+        try:
+            with self._timed("delete_many"):
+                return await self.raw.delete_many(filter)
+        finally:
+            self._invalidate(filter)
+
+    async def bulk_write(self, requests: list, *, ordered: bool = False):
+        try:
+            with self._timed("bulk_write"):
+                return await self.raw.bulk_write(requests, ordered=ordered)
+        finally:
+            if self.cache is not None:
+                for request in requests:
+                    # InsertOne has no filter, the id is in the document.
+                    filter = getattr(request, "_filter", None)
+                    if filter is None:
+                        filter = {"_id": request._doc.get("_id")}
+                    self._invalidate(filter)
+
+    async def create_index(self, keys, **kwargs):
+        with self._timed("create_index"):
+            return await self.raw.create_index(keys, **kwargs)
+
+
+class WriteBuffer:
+    """
+    Buffers high frequency writes, like counters, and writes them in batches.
+
+    ``$inc`` and ``$set`` updates to the same document are merged in memory and
+    written as one upserting ``bulk_write`` per collection, once ``max_pending``
+    documents are waiting or every ``interval`` seconds. Whatever is left is
+    written when the bot closes. Buffered writes aren't visible to reads until
+    they've been flushed. Writes that failed are retried, except increments that
+    may have been applied already when it isn't known how far a batch got.
+    """
+
+    def __init__(self, database: "Database", *, max_pending: int = 1000, interval: float = 5.0):
+        self.database = database
+        self.max_pending = max_pending
+        self.interval = interval
+
+        self._pending: Dict[Tuple[str, Any], Dict[str, dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+
+        self.flush_stats = OperationStats()
+        self.last_batch_size = 0
+        self.largest_batch_size = 0
+        self.writes_merged = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def inc(self, collection: str, document_id: Any, **fields: float):
+        self._merge((collection, document_id), {"$inc": fields})
+
+    def set(self, collection: str, document_id: Any, **fields: Any):
+        self._merge((collection, document_id), {"$set": fields})
+
+    def _merge(self, key: Tuple[str, Any], update: Dict[str, dict]):
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {"$inc": {}, "$set": {}}
+        else:
+            self.writes_merged += 1
+
+        for field, value in update.get("$set", {}).items():
+            # A $set replaces anything still waiting to be added to the field.
+            pending["$inc"].pop(field, None)
+            pending["$set"][field] = value
+
+        for field, amount in update.get("$inc", {}).items():
+            if field in pending["$set"]:
+                # Mongo can't $set and $inc one field in an update, so fold it into the $set.
+                pending["$set"][field] += amount
+            else:
+                pending["$inc"][field] = pending["$inc"].get(field, 0) + amount
+
+        if len(self._pending) >= self.max_pending:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._safe_flush())
+
+    async def _safe_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Flushing buffered writes failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._schedule_flush()
+            await asyncio.shield(self._flushing)
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        batches: Dict[str, list] = {}
+        # The document of each request, by its index in the batch.
+        batches_keys: Dict[str, list] = {}
+        for (collection, document_id), update in pending.items():
+            batches.setdefault(collection, []).append(
+                UpdateOne({"_id": document_id}, {op: fields for op, fields in update.items() if fields}, upsert=True)
+            )
+            batches_keys.setdefault(collection, []).append(document_id)
+
+        self.last_batch_size = len(pending)
+        self.largest_batch_size = max(self.largest_batch_size, self.last_batch_size)
+
+        start = time.perf_counter()
+        attempted = set()
+        failed = None
+        try:
+            for collection, requests in batches.items():
+                attempted.add(collection)
+                try:
+                    await self.database.collection(collection).bulk_write(requests, ordered=False)
+                except BulkWriteError as error:
+                    failed = error
+                    # Everything but the listed writes was applied, only those are retried.
+                    for write_error in error.details.get("writeErrors", ()):
+                        key = (collection, batches_keys[collection][write_error["index"]])
+                        self._restore(key, pending[key])
+                except Exception as error:
+                    failed = error
+                    # Whether any of it was applied isn't known. Setting a field again is
+                    # harmless but adding to it twice isn't, so only the $set parts are retried.
+                    dropped = 0
+                    for document_id in batches_keys[collection]:
+                        key = (collection, document_id)
+                        update = pending[key]
+                        dropped += len(update["$inc"])
+                        if update["$set"]:
+                            self._restore(key, {"$inc": {}, "$set": update["$set"]})
+                    if dropped:
+                        log.error(f"Dropped {plural(dropped, 'buffered increment')} to {collection}, they may not have been written")
+        finally:
+            self.flush_stats.record(time.perf_counter() - start, failed is not None)
+            # Collections that weren't written to at all are retried as they are.
+            for key, update in pending.items():
+                if key[0] not in attempted:
+                    self._restore(key, update)
+        if failed is not None:
+            raise failed
+
+    def _restore(self, key: Tuple[str, Any], update: Dict[str, dict]):
+        # Puts back a write that failed, underneath anything buffered for the document since.
+        newer = self._pending.pop(key, None)
+        self._pending[key] = update
+        if newer is not None:
+            self._merge(key, newer)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+        await self._safe_flush()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "flushes": self.flush_stats.count,
+            "failed_flushes": self.flush_stats.errors,
+            "average_flush": self.flush_stats.average,
+            "max_flush": self.flush_stats.max,
+            "last_batch_size": self.last_batch_size,
+            "largest_batch_size": self.largest_batch_size,
+            "writes_merged": self.writes_merged,
+        }
+
+
+class Database:
+    """
+    The bot's database, shared by every cog through ``bot.db``.
+
+    Collections are available as ``bot.db["name"]`` or ``bot.db.collection("name")``,
+    never as attributes since a collection could share a name with one. The
+    client is created on startup with a connection pool and closed when the
+    bot closes, the ``memory`` backend keeps everything in process so cogs
+    can run without a mongo server.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        uri: Optional[str] = None,
+        backend: str = "mongo",
+        cache_ttl: float = 300,
+        cache_size: int = 10000,
+        negative_cache_ttl: float = 60,
+        buffer_size: int = 1000,
+        buffer_interval: float = 5.0,
+        **options
+    ):
+        self.name = name
+        self.uri = uri
+        self.backend = backend
+        self.options = options
+        self.cache_defaults = {
+            "ttl": cache_ttl,
+            "max_entries": cache_size,
+            "negative_ttl": negative_cache_ttl,
+        }
+
+        self.client = None
+        self._collections: Dict[str, Collection] = {}
+        self.buffer = WriteBuffer(self, max_pending=buffer_size, interval=buffer_interval)
+
+    @classmethod
+    def from_config(cls, config: MongoConfig) -> "Database":
+        # Credentials can also be part of the uri, these are only passed on when set.
+        credentials = {}
+        if config.username:
+            credentials["username"] = config.username
+        if config.password:
+            credentials["password"] = config.password
+        return cls(
+            config.database,
+            uri=config.uri,
+            backend=config.backend,
+            cache_ttl=config.cache_ttl,
+            cache_size=config.cache_size,
+            negative_cache_ttl=config.negative_cache_ttl,
+            buffer_size=config.write_buffer_size,
+            buffer_interval=config.write_buffer_interval,
+            maxPoolSize=config.pool_size,
+            minPoolSize=config.min_pool_size,
+            **credentials,
+        )
+
+    def connect(self):
+        if self.client is not None:
+            return
+        if self.backend == "memory":
+            self.client = MemoryClient()
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self.client = AsyncIOMotorClient(self.uri, **self.options)
+        self.buffer.start()
+
+    async def close(self):
+        if self.client is not None:
+            await self.buffer.close()
+            self.client.close()
+            self.client = None
+
+    @property
+    def raw(self):
+        if self.client is None:
+            raise RuntimeError("The database isn't connected yet.")
+        return self.client[self.name]
+
+    def collection(self, name: str) -> Collection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = Collection(self, name)
+        return collection
+
+    def __getitem__(self, name: str) -> Collection:
+        return self.collection(name)
+
+    def cache(self, name: str, ttl: Optional[float] = None, max_entries: Optional[int] = None, **kwargs) -> Collection:
+        """
+        A collection with read-through caching enabled, ``[MONGO]`` has the defaults.
+        """
+        collection = self.collection(name)
+        if collection.cache is None:
+            collection.enable_cache(ttl, max_entries, **kwargs)
+        return collection
+
+    def stats(self) -> Dict[str, Dict[str, OperationStats]]:
+        return {name: collection.stats for name, collection in self._collections.items() if collection.stats}
+
+    def cache_stats(self) -> Dict[str, dict]:
+        return {
+            name: collection.cache.stats()
+            for name, collection in self._collections.items()
+            if collection.cache is not None
+        }
+
+
+# <--- The in memory backend --->
+
+class Result:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _get_path(document: dict, path: str) -> Tuple[bool, Any]:
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _set_path(document: dict, path: str, value: Any):
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _unset_path(document: dict, path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(last, None)
+
+
+def _compare(found: bool, value: Any, condition: Any) -> bool:
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        return found and value == condition
+
+    for operator, operand in condition.items():
+        if operator == "$exists":
+            if found != bool(operand):
+                return False
+        elif operator == "$ne":
+            if found and value == operand:
+                return False
+        elif operator == "$in":
+            if not found or value not in operand:
+                return False
+        elif operator == "$nin":
+            if found and value in operand:
+                return False
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            if not found or value is None:
+                return False
+            try:
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+            except TypeError:
+                return False
+        else:
+            raise NotImplementedError(f"The memory backend doesn't support {operator}.")
+    return True
+
+
+def matches(document: dict, filter: dict) -> bool:
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif not _compare(*_get_path(document, key), condition):
+            return False
+    return True
+
+
+def apply_update(document: dict, update: dict, *, inserting: bool = False):
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                _set_path(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                pass
+            elif operator == "$unset":
+                _unset_path(document, path)
+            elif operator == "$inc":
+                _, current = _get_path(document, path)
+                _set_path(document, path, (current or 0) + value)
+            elif operator == "$push":
+                found, current = _get_path(document, path)
+                _set_path(document, path, (current if found else []) + [copy.deepcopy(value)])
+            elif operator == "$pull":
+                found, current = _get_path(document, path)
+                if found:
+                    _set_path(document, path, [item for item in current if item != value])
+            else:
+                raise NotImplementedError(f"The memory backend doesn't support {operator}.")
+
+
+class MemoryCursor:
+    def __init__(self, documents: List[dict]):
+        self._documents = documents
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, keys: SortSpec):
+        for key, direction in reversed(list(keys)):
+            self._documents.sort(
+                key=lambda document: (_get_path(document, key)[1] is not None, _get_path(document, key)[1]),
+                reverse=direction < 0,
+            )
+        return self
+
+    def skip(self, amount: int):
+        self._skip = amount
+        return self
+
+    def limit(self, amount: int):
+        self._limit = amount
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        end = self._skip + self._limit if self._limit else None
+        documents = self._documents[self._skip:end]
+        if length:
+            documents = documents[:length]
+        return [copy.deepcopy(document) for document in documents]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in await self.to_list():
+            yield document
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._documents: Dict[Any, dict] = {}
+        self._next_id = 0
+
+    def _matching(self, filter: dict) -> Iterable[dict]:
+        if set(filter) == {"_id"} and not isinstance(filter["_id"], dict):
+            document = self._documents.get(filter["_id"])
+            return [document] if document is not None else []
+        return [document for document in self._documents.values() if matches(document, filter)]
+
+    async def find_one(self, filter: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        for document in self._matching(filter):
+            return copy.deepcopy(document)
+        return None
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor(list(self._matching(filter or {})))
+
+    async def count_documents(self, filter: Optional[dict] = None) -> int:
+        return len(list(self._matching(filter or {})))
+
+    async def insert_one(self, document: dict):
+        document = copy.deepcopy(document)
+        if "_id" not in document:
+            self._next_id += 1
+            document["_id"] = self._next_id
+        if document["_id"] in self._documents:
+            raise KeyError(f"Duplicate _id {document['_id']!r} in {self.name}.")
+        self._documents[document["_id"]] = document
+        return Result(inserted_id=document["_id"])
+
+    async def _update(self, filter: dict, update: dict, upsert: bool, many: bool):
+        matched = list(self._matching(filter))
+        if not many:
+            matched = matched[:1]
+
+        for document in matched:
+            apply_update(document, update)
+
+        upserted_id = None
+        if not matched and upsert:
+            document = {key: value for key, value in filter.items() if not key.startswith("$") and not isinstance(value, dict)}
+            apply_update(document, update, inserting=True)
+            upserted_id = (await self.insert_one(document)).inserted_id
+
+        return Result(matched_count=len(matched), modified_count=len(matched), upserted_id=upserted_id)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        return await self._update(filter, update, upsert, many=False)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False):
+        return await self._update(filter, update, upsert, many=True)
+
+    async def delete_one(self, filter: dict):
+        for document in self._matching(filter):
+            del self._documents[document["_id"]]
+            return Result(deleted_count=1)
+        return Result(deleted_count=0)
+
+    async def delete_many(self, filter: dict):
+        matched = list(self._matching(filter))
+        for document in matched:
+            del self._documents[document["_id"]]
+        return Result(deleted_count=len(matched))
+
+    async def bulk_write(self, requests: list, ordered: bool = False):
+        # Takes the pymongo request classes (UpdateOne, InsertOne, ...) like motor does.
+        counts = {"inserted_count": 0, "matched_count": 0, "deleted_count": 0, "upserted_count": 0}
+        for request in requests:
+            kind = type(request).__name__
+            if kind == "InsertOne":
+                await self.insert_one(request._doc)
+                counts["inserted_count"] += 1
+            elif kind in ("UpdateOne", "UpdateMany"):
+                result = await self._update(request._filter, request._doc, request._upsert, kind == "UpdateMany")
+                counts["matched_count"] += result.matched_count
+                counts["upserted_count"] += result.upserted_id is not None
+            elif kind in ("DeleteOne", "DeleteMany"):
+                result = await (self.delete_one if kind == "DeleteOne" else self.delete_many)(request._filter)
+                counts["deleted_count"] += result.deleted_count
+            else:
+                raise NotImplementedError(f"The memory backend doesn't support {kind}.")
+        return Result(**counts)
+
+    async def create_index(self, keys, **kwargs):
+        return keys if isinstance(keys, str) else "_".join(f"{key}_{direction}" for key, direction in keys)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(name)
+        return collection
+
+
+class MemoryClient:
+    """
+    Stands in for ``AsyncIOMotorClient``, supports the operations ``Collection`` uses.
+    """
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(name)
+        return database
+
+    def close(self):
+        pass
@@ -0,0 +1,343 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import ast
+import asyncio
+import compileall
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+from discord.ext import commands
+
+log = logging.getLogger("rickbot")
+
+# Bump when Manifest changes so cached manifests are scanned again.
+MANIFEST_VERSION = 2
+
+COMMAND_DECORATORS = ("command", "group")
+LISTENER_DECORATORS = ("listener", "event", "loop")
+
+
+@dataclass
+class Manifest:
+    """
+    What an extension provides, read from its source without importing it.
+    """
+
+    path: str
+    mtime: float = 0.0
+    commands: List[List] = field(default_factory=list)
+    listeners: bool = False
+    lazy: bool = True
+    imports: List[str] = field(default_factory=list)
+    intents: List[str] = field(default_factory=list)
+    member_cache: List[str] = field(default_factory=list)
+
+    @property
+    def eager(self) -> bool:
+        # Listeners only work once the module is imported, so anything with
+        # them (or without any commands to trigger the import) loads at startup.
+        return self.listeners or not self.lazy or not self.commands
+
+    @property
+    def metadata(self) -> dict:
+        """
+        The metadata saved next to an installed extension, empty for anything else.
+        """
+        metadata_path = f"{os.path.splitext(self.path)[0]}.json"
+        if not os.path.exists(metadata_path):
+            return {}
+        try:
+            with open(metadata_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def _decorator_name(node: ast.expr) -> Optional[str]:
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def _is_top_level_command(node: ast.expr) -> bool:
+    # "@commands.command()" and "@command()" are top level, "@parent.command()" is a subcommand.
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Name):
+        return node.id in COMMAND_DECORATORS
+    return (
+        isinstance(node, ast.Attribute)
+        and node.attr in COMMAND_DECORATORS
+        and isinstance(node.value, ast.Name)
+        and node.value.id in ("commands", "bridge")
+    )
+
+
+def _constant(node: Optional[ast.expr]):
+    try:
+        return ast.literal_eval(node) if node is not None else None
+    except (ValueError, TypeError, SyntaxError):
+        return None
+
+
+def scan_extension(path: str) -> Manifest:
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    manifest = Manifest(path=path, mtime=os.path.getmtime(path))
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for decorator in node.decorator_list:
+                if _is_top_level_command(decorator):
+                    keywords = {}
+                    if isinstance(decorator, ast.Call):
+                        keywords = {kw.arg: kw.value for kw in decorator.keywords}
+                    name = _constant(keywords.get("name")) or node.name
+                    aliases = list(_constant(keywords.get("aliases")) or [])
+                    manifest.commands.append([name, aliases])
+                elif _decorator_name(decorator) in LISTENER_DECORATORS:
+                    manifest.listeners = True
+
+        elif isinstance(node, ast.Call) and _decorator_name(node.func) == "add_listener":
+            manifest.listeners = True
+
+        elif isinstance(node, ast.Assign):
+            targets = [target.id for target in node.targets if isinstance(target, ast.Name)]
+            if "__lazy__" in targets and _constant(node.value) is False:
+                manifest.lazy = False
+            # Module level or on the cog class, ast.walk sees both.
+            if "__intents__" in targets:
+                manifest.intents.extend(_constant(node.value) or [])
+            if "__member_cache__" in targets:
+                manifest.member_cache.extend(_constant(node.value) or [])
+
+        elif isinstance(node, ast.Import):
+            manifest.imports.extend(alias.name for alias in node.names)
+
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            manifest.imports.append(node.module)
+            manifest.imports.extend(f"{node.module}.{alias.name}" for alias in node.names)
+
+    return manifest
+
+
+class ManifestStore:
+    """
+    Manifests of every extension, cached on disk and rescanned when the source changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._manifests: Dict[str, Manifest] = {}
+        self._dirty = False
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["version"] == MANIFEST_VERSION:
+                for manifest in data["manifests"]:
+                    self._manifests[manifest["path"]] = Manifest(**manifest)
+        except (OSError, ValueError, TypeError, KeyError):
+            pass
+
+    def get(self, path: str) -> Manifest:
+        manifest = self._manifests.get(path)
+        if manifest is None or manifest.mtime != os.path.getmtime(path):
+            manifest = self._manifests[path] = scan_extension(path)
+            self._dirty = True
+        return manifest
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "manifests": [asdict(manifest) for manifest in self._manifests.values()],
+            }, f)
+        self._dirty = False
+
+
+class LazyLoader:
+    """
+    Registers stub commands for extensions that haven't been imported yet,
+    the first use of a stub loads the real extension and runs the message again.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.pending: Dict[str, List[commands.Command]] = {}
+
+    def defer(self, extension: str, manifest: Manifest) -> bool:
+        if manifest.eager:
+            return False
+
+        stubs = []
+        try:
+            for name, aliases in manifest.commands:
+                stub = self._make_stub(extension, name, aliases)
+                self.bot.add_command(stub)
+                stubs.append(stub)
+        except commands.CommandRegistrationError:
+            # Clashes with an existing command, let the real load report it.
+            self._remove_stubs(stubs)
+            return False
+
+        self.pending[extension] = stubs
+        return True
+
+    def load(self, extension: str):
+        if extension in self.bot.extensions:
+            # Loaded by an earlier use of a stub, a hot reload or load_all.
+            self.discard(extension)
+            return
+        self.bot.load_extension(extension)
+
+    def load_all(self):
+        for extension in list(self.pending):
+            self.load(extension)
+
+    def discard(self, extension: str):
+        self._remove_stubs(self.pending.pop(extension, []))
+
+    def _remove_stubs(self, stubs: List[commands.Command]):
+        for stub in stubs:
+            if self.bot.all_commands.get(stub.name) is stub:
+                self.bot.remove_command(stub.name)
+
+    def _make_stub(self, extension: str, name: str, aliases: List[str]) -> commands.Command:
+        async def stub(ctx):
+            log.info(f"Loading {extension} for its first use")
+            self.load(extension)
+            await ctx.bot.process_commands(ctx.message)
+
+        return commands.Command(stub, name=name, aliases=aliases, hidden=True)
+
+
+class ExtensionLoader:
+    """
+    Loads extensions eagerly, the expensive parts run concurrently and the
+    extensions are registered with the bot in dependency order.
+
+    Dependencies come from imports of other cogs/features in the source and the
+    ``requires`` list in the metadata saved next to an installed extension.
+    """
+
+    def __init__(self, bot: commands.Bot, workers: Optional[int] = None):
+        self.bot = bot
+        self.workers = workers
+        # Seconds per stage, per extension.
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def load(self, extensions: Dict[str, Manifest]):
+        graph = {name: self.dependencies(name, manifest, extensions) for name, manifest in extensions.items()}
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="rick-loader") as pool:
+            for name, taken in pool.map(self._warm_up, extensions.keys(), extensions.values()):
+                self.timings.setdefault(name, {})["warm-up"] = taken
+
+        for name in self.order(graph):
+            start = time.perf_counter()
+            self.bot.load_extension(name)
+            self.timings[name]["load"] = time.perf_counter() - start
+
+    async def prepare(self):
+        """
+        Runs the optional ``async def prepare(bot)`` of every loaded extension concurrently,
+        this is where extensions should do their startup I/O.
+        """
+        async def run(name, func):
+            start = time.perf_counter()
+            try:
+                await func(self.bot)
+            except Exception:
+                log.exception(f"Preparing {name} failed")
+            self.timings.setdefault(name, {})["prepare"] = time.perf_counter() - start
+
+        await asyncio.gather(*(
+            run(name, module.prepare)
+            for name, module in self.bot.extensions.items()
+            if asyncio.iscoroutinefunction(getattr(module, "prepare", None))
+        ))
+
+    @staticmethod
+    def dependencies(name: str, manifest: Manifest, extensions: Dict[str, Manifest]) -> List[str]:
+        found = set()
+        for module in manifest.imports:
+            for extension in extensions:
+                if extension != name and (module == extension or module.startswith(f"{extension}.")):
+                    found.add(extension)
+
+        for raw_name in manifest.metadata.get("requires", []):
+            found.update(
+                extension for extension in (f"cogs.{raw_name}", f"features.{raw_name}")
+                if extension in extensions
+            )
+
+        return sorted(found)
+
+    @staticmethod
+    def order(graph: Dict[str, List[str]]) -> List[str]:
+        waiting = {name: set(deps) for name, deps in graph.items()}
+        ordered = []
+        while waiting:
+            ready = [name for name, deps in waiting.items() if not deps]
+            if not ready:
+                # A dependency cycle, load what's left in its original order.
+                log.warning(f"Dependency cycle between {', '.join(waiting)}")
+                ready = list(waiting)
+            for name in ready:
+                ordered.append(name)
+                del waiting[name]
+            for deps in waiting.values():
+                deps.difference_update(ready)
+        return ordered
+
+    @staticmethod
+    def _warm_up(name: str, manifest: Manifest):
+        start = time.perf_counter()
+
+        # Write the bytecode so the import on the main thread doesn't compile.
+        compileall.compile_file(manifest.path, quiet=2)
+
+        # Import whatever the extension imports, apart from other extensions.
+        for module in manifest.imports:
+            if module in sys.modules or module.split(".")[0] in ("cogs", "features", "internal"):
+                continue
+            try:
+                importlib.import_module(module)
+            except Exception:
+                # Not a module ("from x import function") or broken, the real load will report it.
+                pass
+
+        return name, time.perf_counter() - start
+
+    def report(self) -> str:
+        stages = ("warm-up", "load", "prepare")
+        rows = sorted(self.timings.items(), key=lambda item: -sum(item[1].values()))
+        width = max([len("Extension")] + [len(name) for name, _ in rows])
+
+        lines = [f"{'Extension':<{width}}  " + "  ".join(f"{stage:>8}" for stage in stages) + f"  {'total':>8}"]
+        for name, timings in rows:
+            lines.append(
+                f"{name:<{width}}  "
+                + "  ".join(f"{timings.get(stage, 0.0) * 1000:>6.1f}ms" for stage in stages)
+                + f"  {sum(timings.values()) * 1000:>6.1f}ms"
+            )
+        return "\n".join(lines)
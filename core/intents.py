@@ -0,0 +1,89 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+import discord
+
+from .config import RickConfig
+
+log = logging.getLogger("rickbot")
+
+# What rick itself needs to run prefix commands in servers.
+BASE_INTENTS = ("guilds", "guild_messages", "message_content")
+
+# Rough sizes used to estimate what not caching saves, not measurements.
+MEMBER_BYTES = 1200
+PRESENCE_BYTES = 600
+
+
+class IntentBudget:
+    """
+    The intents and member cache the loaded extensions actually need.
+
+    Extensions declare what they need with ``__intents__`` and ``__member_cache__``
+    lists, at module level or on their cog, or with ``intents`` in their metadata.
+    ``sources`` records which extensions asked for each intent.
+    """
+
+    def __init__(self, intents: discord.Intents, member_cache_flags: discord.MemberCacheFlags, sources: Dict[str, List[str]]):
+        self.intents = intents
+        self.member_cache_flags = member_cache_flags
+        self.sources = sources
+
+    @classmethod
+    def from_requests(
+        cls,
+        config: RickConfig,
+        intents: Dict[str, List[str]],
+        member_cache: Dict[str, List[str]]
+    ) -> "IntentBudget":
+        if config.intents.lower() == "all":
+            everything = discord.Intents.all()
+            return cls(everything, discord.MemberCacheFlags.from_intents(everything), {"config": ["all"]})
+
+        valid = discord.Intents.VALID_FLAGS
+        sources: Dict[str, List[str]] = {name: ["rick"] for name in BASE_INTENTS if name in valid}
+
+        for extension, names in intents.items():
+            for name in names:
+                if name not in valid:
+                    log.warning(f"{extension} asked for the unknown intent {name!r}")
+                    continue
+                sources.setdefault(name, []).append(extension)
+
+        budget = discord.Intents.none()
+        for name in sources:
+            setattr(budget, name, True)
+
+        flags = discord.MemberCacheFlags.from_intents(budget)
+        declared = {name for names in member_cache.values() for name in names}
+        if declared:
+            # Only cache what was asked for, as long as the intents allow it.
+            flags = discord.MemberCacheFlags.none()
+            allowed = discord.MemberCacheFlags.from_intents(budget)
+            for name in declared:
+                if name not in discord.MemberCacheFlags.VALID_FLAGS:
+                    log.warning(f"Unknown member cache flag {name!r}")
+                elif getattr(allowed, name):
+                    setattr(flags, name, True)
+                else:
+                    log.warning(f"The member cache flag {name!r} needs an intent no extension asked for")
+
+        return cls(budget, flags, sources)
+
+    @property
+    def disabled(self) -> List[str]:
+        return sorted(name for name, enabled in self.intents if not enabled)
+
+    def estimate_saved(self, guilds: List[discord.Guild]) -> Tuple[int, int]:
+        """
+        The estimated bytes saved by not caching members and presences.
+        """
+        members = sum(guild.member_count or 0 for guild in guilds)
+        saved_members = 0 if self.member_cache_flags.joined else members * MEMBER_BYTES
+        saved_presences = 0 if self.intents.presences else members * PRESENCE_BYTES
+        return saved_members, saved_presences
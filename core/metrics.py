@@ -0,0 +1,274 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from .config import MetricsConfig
+
+log = logging.getLogger("rickbot")
+
+# Upper bounds in seconds, from a fast cached reply to a slow web request.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ("parse", "prepare", "body")
+
+# Installing a cog downloads a repo, so its stages take far longer than a command.
+INSTALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, observing is a bisect and an increment.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # The last bucket is everything above the highest bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def average(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        The upper bound of the bucket the quantile falls in.
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def prometheus(self, name: str, labels: str = "") -> List[str]:
+        prefix = f"{labels}," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class CommandMetrics:
+    __slots__ = ("count", "errors", "latency", "phases")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class Metrics:
+    """
+    Command, gateway and event loop metrics, available as ``bot.metrics``.
+
+    A command's time is split into ``parse`` (getting the prefix and context),
+    ``prepare`` (checks, cooldowns and converters, up to ``before_invoke``) and
+    ``body`` (up to ``after_invoke``). With ``[METRICS] enabled`` they are served
+    in the Prometheus format on localhost.
+    """
+
+    def __init__(
+        self,
+        bot,
+        *,
+        enabled: bool = False,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        lag_interval: float = 0.5
+    ):
+        self.bot = bot
+        self.enabled = enabled
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+
+        self.commands: Dict[str, CommandMetrics] = {}
+        self.events: Dict[str, int] = {}
+        self.loop_lag = Histogram()
+        # Seconds spent in each stage of installing a cog, by stage.
+        self.install_stages: Dict[str, Histogram] = {}
+        self.last_lag = 0.0
+        self.started = time.time()
+
+        # Totals every 10 seconds for the last minute, to work out recent event rates.
+        self._event_samples: Deque[Tuple[float, int]] = deque(maxlen=7)
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def from_config(cls, bot, config: MetricsConfig) -> "Metrics":
+        return cls(
+            bot,
+            enabled=config.enabled,
+            host=config.host,
+            port=config.port,
+            lag_interval=config.loop_lag_interval,
+        )
+
+    # <--- Recording --->
+
+    def record_command(self, ctx, total: float):
+        metrics = self.commands.get(ctx.command.qualified_name)
+        if metrics is None:
+            metrics = self.commands[ctx.command.qualified_name] = CommandMetrics()
+
+        metrics.count += 1
+        if ctx.command_failed:
+            metrics.errors += 1
+        metrics.latency.observe(total)
+
+        timings = ctx.timings
+        if "parse" in timings:
+            metrics.phases["parse"].observe(timings["parse"])
+        if "before" in timings:
+            metrics.phases["prepare"].observe(timings["before"] - timings["invoked"])
+            if "after" in timings:
+                metrics.phases["body"].observe(timings["after"] - timings["before"])
+
+    def record_install(self, timings: Dict[str, float]):
+        for stage, taken in timings.items():
+            histogram = self.install_stages.get(stage)
+            if histogram is None:
+                histogram = self.install_stages[stage] = Histogram(INSTALL_BUCKETS)
+            histogram.observe(taken)
+
+    def record_event(self, event_type: str):
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+
+    def event_rate(self) -> float:
+        """
+        Gateway events per second over about the last minute.
+        """
+        if len(self._event_samples) < 2:
+            return 0.0
+        (start, first), (end, last) = self._event_samples[0], self._event_samples[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    # <--- Background tasks --->
+
+    async def _measure_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            # However much longer than asked the sleep took, the loop was busy for.
+            self.last_lag = max(0.0, time.perf_counter() - start - self.lag_interval)
+            self.loop_lag.observe(self.last_lag)
+
+    async def _sample_events(self):
+        while True:
+            self._event_samples.append((time.monotonic(), sum(self.events.values())))
+            await asyncio.sleep(10)
+
+    async def start(self):
+        self._tasks = [
+            asyncio.ensure_future(self._measure_lag()),
+            asyncio.ensure_future(self._sample_events()),
+        ]
+        if not self.enabled:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_scrape)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        # Each cluster serves its own metrics on the next port.
+        port = self.port + self.bot.ipc.cluster_id
+        try:
+            await web.TCPSite(self._runner, self.host, port).start()
+        except OSError as error:
+            log.error(f"Metrics couldn't be served on {self.host}:{port}: {error}")
+            return
+        log.info(f"Serving metrics on http://{self.host}:{port}/metrics")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # <--- Output --->
+
+    async def _handle_scrape(self, _request: web.Request) -> web.Response:
+        return web.Response(text=self.prometheus(), content_type="text/plain", charset="utf-8")
+
+    def prometheus(self) -> str:
+        lines = [
+            "# TYPE rick_commands_total counter",
+            *(f'rick_commands_total{{command="{_label(name)}"}} {metrics.count}' for name, metrics in self.commands.items()),
+            "# TYPE rick_command_errors_total counter",
+            *(f'rick_command_errors_total{{command="{_label(name)}"}} {metrics.errors}' for name, metrics in self.commands.items()),
+            "# TYPE rick_command_latency_seconds histogram",
+        ]
+        for name, metrics in self.commands.items():
+            lines.extend(metrics.latency.prometheus("rick_command_latency_seconds", f'command="{_label(name)}"'))
+
+        lines.append("# TYPE rick_command_phase_seconds histogram")
+        for name, metrics in self.commands.items():
+            for phase, histogram in metrics.phases.items():
+                lines.extend(histogram.prometheus(
+                    "rick_command_phase_seconds", f'command="{_label(name)}",phase="{phase}"'
+                ))
+
+        lines.append("# TYPE rick_gateway_events_total counter")
+        lines.extend(f'rick_gateway_events_total{{event="{_label(name)}"}} {count}' for name, count in self.events.items())
+
+        lines.append("# TYPE rick_install_stage_seconds histogram")
+        for stage, histogram in self.install_stages.items():
+            lines.extend(histogram.prometheus("rick_install_stage_seconds", f'stage="{_label(stage)}"'))
+
+        lines.append("# TYPE rick_loop_lag_seconds histogram")
+        lines.extend(self.loop_lag.prometheus("rick_loop_lag_seconds"))
+
+        scheduler = self.bot.scheduler
+        lines.append("# TYPE rick_job_lag_seconds histogram")
+        for name, stats in scheduler.handler_stats.items():
+            lines.extend(stats.lag.prometheus("rick_job_lag_seconds", f'handler="{_label(name)}"'))
+        for kind in ("ran", "failed", "skipped"):
+            lines.append(f"# TYPE rick_jobs_{kind}_total counter")
+            lines.extend(
+                f'rick_jobs_{kind}_total{{handler="{_label(name)}"}} {getattr(stats, kind)}'
+                for name, stats in scheduler.handler_stats.items()
+            )
+
+        lines.extend([
+            "# TYPE rick_guilds gauge",
+            f"rick_guilds {len(self.bot.guilds)}",
+            "# TYPE rick_gateway_latency_seconds gauge",
+            f"rick_gateway_latency_seconds {self.bot.latency if math.isfinite(self.bot.latency) else 0}",
+            "# TYPE rick_uptime_seconds gauge",
+            f"rick_uptime_seconds {time.time() - self.started}",
+        ])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,316 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Union
+
+import discord
+
+from utils import TTLCache
+
+from .config import OutboundConfig
+from .database import OperationStats
+
+log = logging.getLogger("rickbot")
+
+# Discord's limit on a message's content.
+MAX_CONTENT = 2000
+
+# Discord's error for replying to a message it can't reply to.
+UNKNOWN_REFERENCE = 160002
+# Invalid Form Body, only about the reply when the field errors point at message_reference.
+INVALID_FORM_BODY = 50035
+
+
+def is_reference_error(error: discord.HTTPException) -> bool:
+    """
+    Whether discord refused a message only because of the message it replies to,
+    so it can be sent again without the reply.
+    """
+    if error.code == UNKNOWN_REFERENCE:
+        return True
+    # discord.py flattens the field errors into the text, one "In field: message" per line.
+    return error.code == INVALID_FORM_BODY and "In message_reference" in (error.text or "")
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` sends every ``per`` seconds, refilling smoothly.
+    """
+
+    __slots__ = ("rate", "per", "tokens", "updated")
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """
+        Seconds until a send is allowed, 0 if one is allowed now.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Outgoing:
+    __slots__ = ("content", "reference", "kwargs", "coalesce", "future", "queued_at")
+
+    def __init__(self, content: Optional[str], reference: Any, kwargs: dict, coalesce: bool, future: asyncio.Future):
+        self.content = content
+        self.reference = reference
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+        self.queued_at = time.monotonic()
+
+    @property
+    def mergeable(self) -> bool:
+        # Only plain text can be joined with other sends.
+        return self.coalesce and isinstance(self.content, str) and self.reference is None and not self.kwargs
+
+
+class ChannelQueue:
+    __slots__ = ("channel", "bucket", "pending", "worker")
+
+    def __init__(self, channel: discord.abc.Messageable, bucket: TokenBucket):
+        self.channel = channel
+        self.bucket = bucket
+        self.pending: Deque[Outgoing] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class RateLimitCounter(logging.Handler):
+    """
+    Counts the 429s discord.py logs, it retries them itself so they are never raised.
+    """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+        self.global_count = 0
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage().lower()
+        if "rate limit" in message:
+            self.count += 1
+            if "global" in message:
+                self.global_count += 1
+
+
+class MessageScheduler:
+    """
+    Every message rick sends goes through here, available as ``bot.outbound``.
+
+    Each channel has a queue that waits for its own token bucket (and a global
+    one) before sending, so discord's limits are respected up front instead of
+    being found out with a 429. Sends with ``coalesce=True`` that are still
+    queued when a slot frees up are joined into one message, and a reply is
+    checked against messages known to be deleted and the channel's permissions
+    before it is sent so it doesn't need a second try.
+    """
+
+    def __init__(
+        self,
+        bot,
+        *,
+        channel_rate: int = 5,
+        channel_per: float = 5.0,
+        global_rate: int = 50,
+        deleted_cache_size: int = 10000,
+        bucket_cache_size: int = 10000
+    ):
+        self.bot = bot
+        self.channel_rate = channel_rate
+        self.channel_per = channel_per
+        self.global_bucket = TokenBucket(global_rate, 1.0)
+
+        self.queues: Dict[int, ChannelQueue] = {}
+        # Channel buckets outlive their queues, until they've refilled and are the same as a new one.
+        self.buckets = TTLCache(bucket_cache_size, channel_per)
+        # Deleted message ids, replying to one of these would fail.
+        self.deleted = TTLCache(deleted_cache_size, 600)
+
+        self.wait = OperationStats()
+        self.rate_limits = RateLimitCounter()
+        self.counters = {
+            "sent": 0,
+            "failed": 0,
+            "coalesced": 0,
+            "references_dropped": 0,
+            "reference_fallbacks": 0,
+        }
+
+    @classmethod
+    def from_config(cls, bot, config: OutboundConfig) -> "MessageScheduler":
+        return cls(
+            bot,
+            channel_rate=config.channel_rate,
+            channel_per=config.channel_per,
+            global_rate=config.global_rate,
+        )
+
+    def start(self):
+        logging.getLogger("discord.http").addHandler(self.rate_limits)
+        self.bot.add_listener(self._on_raw_message_delete, "on_raw_message_delete")
+        self.bot.add_listener(self._on_raw_bulk_message_delete, "on_raw_bulk_message_delete")
+
+    def close(self):
+        logging.getLogger("discord.http").removeHandler(self.rate_limits)
+        for queue in self.queues.values():
+            for item in queue.pending:
+                item.future.cancel()
+            if queue.worker is not None:
+                queue.worker.cancel()
+
+    async def _on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.deleted.set(payload.message_id, True)
+
+    async def _on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.deleted.set(message_id, True)
+
+    def is_deleted(self, message_id: int) -> bool:
+        return self.deleted.get(message_id) is not None
+
+    def can_reference(self, channel: discord.abc.Messageable, message: Union[discord.Message, discord.MessageReference]) -> bool:
+        """
+        Whether a reply to ``message`` would be accepted, checked without a request.
+        """
+        message_id = getattr(message, "message_id", None) or getattr(message, "id", None)
+        if message_id is not None and self.is_deleted(message_id):
+            return False
+
+        guild = getattr(channel, "guild", None)
+        if guild is not None and guild.me is not None:
+            return channel.permissions_for(guild.me).read_message_history
+        return True
+
+    async def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: Optional[str] = None,
+        *,
+        reference: Union[discord.Message, discord.MessageReference, None] = None,
+        coalesce: bool = False,
+        **kwargs
+    ) -> discord.Message:
+        """
+        Queues a message for ``channel`` and waits until it is sent. With
+        ``coalesce`` a plain text message may be joined to others sent to the
+        same channel at the same time, they all get the same message back.
+        """
+        # Users and members are sent to in their DM channel.
+        channel = await channel._get_channel()
+        item = Outgoing(content, reference, kwargs, coalesce, self.bot.loop.create_future())
+
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            bucket = self.buckets.get(channel.id)
+            if bucket is None:
+                bucket = TokenBucket(self.channel_rate, self.channel_per)
+            queue = self.queues[channel.id] = ChannelQueue(channel, bucket)
+        queue.pending.append(item)
+        if queue.worker is None:
+            queue.worker = asyncio.ensure_future(self._drain(channel.id, queue))
+
+        return await item.future
+
+    def _next_batch(self, queue: ChannelQueue) -> List[Outgoing]:
+        batch = [queue.pending.popleft()]
+        if not batch[0].mergeable:
+            return batch
+
+        length = len(batch[0].content)
+        while queue.pending and queue.pending[0].mergeable:
+            length += 1 + len(queue.pending[0].content)
+            if length > MAX_CONTENT:
+                break
+            batch.append(queue.pending.popleft())
+        return batch
+
+    async def _drain(self, channel_id: int, queue: ChannelQueue):
+        try:
+            while queue.pending:
+                delay = max(queue.bucket.delay(), self.global_bucket.delay())
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = max(queue.bucket.delay(), self.global_bucket.delay())
+                queue.bucket.take()
+                self.global_bucket.take()
+                # Full again channel_per seconds after the last send, it can be dropped then.
+                self.buckets.set(channel_id, queue.bucket)
+
+                batch = self._next_batch(queue)
+                now = time.monotonic()
+                for item in batch:
+                    self.wait.record(now - item.queued_at, False)
+                await self._deliver(queue.channel, batch)
+        finally:
+            # An idle channel only keeps its bucket, the queue is made again on its next send.
+            if self.queues.get(channel_id) is queue:
+                del self.queues[channel_id]
+
+    async def _deliver(self, channel: discord.abc.Messageable, batch: List[Outgoing]):
+        first = batch[0]
+        content = first.content
+        if len(batch) > 1:
+            content = "\n".join(item.content for item in batch)
+            self.counters["coalesced"] += len(batch) - 1
+
+        try:
+            message = await self._send(channel, content, first.reference, first.kwargs)
+        except Exception as error:
+            self.counters["failed"] += 1
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(error)
+            return
+
+        self.counters["sent"] += 1
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(message)
+
+    async def _send(self, channel: discord.abc.Messageable, content: Optional[str], reference: Any, kwargs: dict) -> discord.Message:
+        if reference is None:
+            return await channel.send(content, **kwargs)
+
+        if not self.can_reference(channel, reference):
+            self.counters["references_dropped"] += 1
+            return await channel.send(content, **kwargs)
+
+        if isinstance(reference, discord.Message):
+            reference = reference.to_reference(fail_if_not_exists=False)
+        try:
+            return await channel.send(content, reference=reference, **kwargs)
+        except discord.HTTPException as error:
+            if not is_reference_error(error):
+                raise
+            # Something the local check can't see, like a message deleted while rick was offline.
+            self.counters["reference_fallbacks"] += 1
+            return await channel.send(content, **kwargs)
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            queued=sum(len(queue.pending) for queue in self.queues.values()),
+            channels=len(self.queues),
+            average_wait=self.wait.average,
+            max_wait=self.wait.max,
+            rate_limits=self.rate_limits.count,
+            global_rate_limits=self.rate_limits.global_count,
+        )
@@ -0,0 +1,113 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+from typing import Dict, Iterable, Optional, Tuple
+
+from discord.ext import commands
+
+from utils import TTLCache
+
+
+class PrefixManager:
+    """
+    Resolves the prefixes of a guild.
+
+    Custom prefixes are stored in the ``prefixes`` collection and kept in memory
+    as ready to match tuples (mentions first, then the longest prefix first) so a
+    message only costs a dict lookup once its guild is cached.
+    """
+
+    def __init__(self, bot: commands.Bot, default: str, *, max_size: int = 10000, ttl: float = 3600):
+        self.bot = bot
+        self.default = default
+        self.cache = TTLCache(max_size, ttl)
+        self.collection = None
+
+        self._mentions: Tuple[str, ...] = ()
+        self._default_prefixes: Tuple[str, ...] = (default,)
+        self._fetching: Dict[int, asyncio.Future] = {}
+
+    def _refresh_mentions(self):
+        # The bot's id isn't known until it has logged in.
+        if not self._mentions and self.bot.user is not None:
+            self._mentions = (f"<@{self.bot.user.id}> ", f"<@!{self.bot.user.id}> ")
+            self._default_prefixes = self._build([self.default])
+            self.cache.clear()
+
+    @property
+    def mentions(self) -> Tuple[str, ...]:
+        self._refresh_mentions()
+        return self._mentions
+
+    @property
+    def default_prefixes(self) -> Tuple[str, ...]:
+        self._refresh_mentions()
+        return self._default_prefixes
+
+    def _build(self, prefixes: Iterable[str]) -> Tuple[str, ...]:
+        return self._mentions + tuple(sorted(set(prefixes), key=len, reverse=True))
+
+    def set_default(self, default: str):
+        """
+        Changes the default prefix, after the config is reloaded.
+        """
+        self.default = default
+        self._default_prefixes = self._build([default])
+        # Guilds without their own prefixes have the old default cached.
+        self.cache.clear()
+        self.bot.help_cache.clear()
+
+    def cached(self, guild_id: int) -> Optional[Tuple[str, ...]]:
+        """
+        The prefixes of a guild if they are cached, without going to the database.
+        """
+        self._refresh_mentions()
+        if self.collection is None:
+            return self._default_prefixes
+        return self.cache.get(guild_id)
+
+    async def get(self, guild_id: Optional[int]) -> Tuple[str, ...]:
+        if guild_id is None:
+            return self.default_prefixes
+
+        prefixes = self.cached(guild_id)
+        if prefixes is not None:
+            return prefixes
+
+        # Share one database read between every message that misses at once.
+        future = self._fetching.get(guild_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._fetching[guild_id] = self.bot.loop.create_future()
+        try:
+            document = await self.collection.find_one({"_id": guild_id})
+            prefixes = self._build(document["prefixes"]) if document else self.default_prefixes
+            self.cache.set(guild_id, prefixes)
+            future.set_result(prefixes)
+            return prefixes
+        except Exception as error:
+            future.set_exception(error)
+            # Nothing else may be waiting, so retrieve it to stop the "never retrieved" warning.
+            future.exception()
+            raise
+        finally:
+            del self._fetching[guild_id]
+
+    async def set(self, guild_id: int, prefixes: Iterable[str]):
+        await self.collection.update_one(
+            {"_id": guild_id}, {"$set": {"prefixes": list(prefixes)}}, upsert=True
+        )
+        self.invalidate(guild_id)
+
+    async def reset(self, guild_id: int):
+        await self.collection.delete_one({"_id": guild_id})
+        self.invalidate(guild_id)
+
+    def invalidate(self, guild_id: int):
+        self.cache.invalidate(guild_id)
+        # Help pages mention the prefix.
+        self.bot.help_cache.clear()
@@ -0,0 +1,157 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import secrets
+import struct
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from .config import RecorderConfig
+
+log = logging.getLogger("rickbot")
+
+RECORDING_VERSION = 1
+
+# Each record is its length as 4 big endian bytes and then the JSON.
+LENGTH = struct.Struct(">I")
+
+# Fields about a person that are replaced along with the ids.
+PERSONAL_FIELDS = ("username", "global_name", "nick", "avatar", "banner", "email", "bio")
+
+
+class Anonymiser:
+    """
+    Replaces snowflakes with made up ones that are the same every time in one
+    recording. The timestamp part of a snowflake is kept so created_at and the
+    order of messages still make sense.
+    """
+
+    def __init__(self, salt: bytes, scrub_content: bool = False):
+        self.salt = salt
+        self.scrub_content = scrub_content
+
+    def _hash(self, value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), key=self.salt, digest_size=8).digest(), "big")
+
+    def snowflake(self, value: Any) -> Any:
+        text = str(value)
+        if not text.isdigit() or len(text) < 15:
+            return value
+        anonymised = (int(text) >> 22 << 22) | (self._hash(text) & 0x3FFFFF)
+        return str(anonymised) if isinstance(value, str) else anonymised
+
+    def __call__(self, data: Any) -> Any:
+        if isinstance(data, list):
+            return [self(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+
+        result = {}
+        for key, value in data.items():
+            if key == "id" or key.endswith("_id"):
+                result[key] = self.snowflake(value)
+            elif key.endswith("_ids") or key in ("roles", "mention_roles"):
+                result[key] = [self.snowflake(item) if not isinstance(item, dict) else self(item) for item in value or ()]
+            elif key in PERSONAL_FIELDS and isinstance(value, str):
+                result[key] = f"{key}-{self._hash(value) & 0xFFFFFF:06x}"
+            elif key == "content" and self.scrub_content and isinstance(value, str):
+                result[key] = "x" * len(value)
+            else:
+                result[key] = self(value)
+        return result
+
+
+class GatewayRecorder:
+    """
+    Records every gateway dispatch the bot parses to a compressed file, for
+    ``tools.replay``. Opt in with ``[RECORDER] enabled``.
+
+    The parsers of the bot's connection state are wrapped so each event is
+    seen exactly as discord.py sees it. On the loop an event is only turned
+    into JSON, anonymising, compressing and writing happen in a thread.
+    """
+
+    def __init__(self, path: str, *, scrub_content: bool = False):
+        self.path = path.format(time=time.strftime("%Y%m%d-%H%M%S"))
+        # A new salt every recording, so ids can't be matched between recordings.
+        self.anonymise = Anonymiser(secrets.token_bytes(16), scrub_content)
+        self.events = 0
+        self.started = time.monotonic()
+
+        self._queue: "queue.SimpleQueue[Optional[Tuple[float, str, str]]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write, name="rick-recorder", daemon=True)
+        self._original = {}
+        self._state = None
+
+    @classmethod
+    def from_config(cls, config: RecorderConfig) -> "GatewayRecorder":
+        return cls(config.path, scrub_content=config.scrub_content)
+
+    def attach(self, state):
+        """
+        Starts recording the dispatches parsed by ``state``, a ConnectionState.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._thread.start()
+        self._state = state
+        self._original = dict(state.parsers)
+        for event, parser in self._original.items():
+            state.parsers[event] = self._wrap(event, parser)
+        log.info(f"Recording gateway events to {self.path}")
+
+    def _wrap(self, event: str, parser: Callable[[dict], Any]) -> Callable[[dict], Any]:
+        def record(data: dict):
+            self.events += 1
+            self._queue.put((time.monotonic() - self.started, event, json.dumps(data)))
+            return parser(data)
+        return record
+
+    def _write(self):
+        with gzip.open(self.path, "wb", compresslevel=6) as file:
+            header = json.dumps({"version": RECORDING_VERSION, "started": time.time()}).encode()
+            file.write(LENGTH.pack(len(header)) + header)
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                offset, event, data = item
+                record = json.dumps([round(offset, 4), event, self.anonymise(json.loads(data))]).encode()
+                file.write(LENGTH.pack(len(record)) + record)
+
+    def close(self):
+        if self._state is not None:
+            self._state.parsers.update(self._original)
+            self._state = None
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            log.info(f"Recorded {self.events} gateway events to {self.path}")
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, str, dict]]:
+    """
+    The (seconds since the recording started, event, data) of each record.
+    """
+    with gzip.open(path, "rb") as file:
+        def read() -> Optional[bytes]:
+            prefix = file.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return None
+            return file.read(LENGTH.unpack(prefix)[0])
+
+        header = read()
+        if header is None or json.loads(header).get("version") != RECORDING_VERSION:
+            raise ValueError(f"{path} isn't a recording this version of rick can read")
+
+        while (record := read()) is not None:
+            offset, event, data = json.loads(record)
+            yield offset, event, data
@@ -0,0 +1,412 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import datetime
+import heapq
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from .config import SchedulerConfig
+from .metrics import Histogram
+
+log = logging.getLogger("rickbot")
+
+# From on time to a job that waited out a restart.
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 3600.0, 86400.0)
+
+Handler = Callable[["Job"], Awaitable[Any]]
+
+
+class Job:
+    """
+    A job as stored in the jobs collection. ``data`` is whatever the handler
+    needs, it has to be something Mongo can store.
+    """
+
+    __slots__ = ("id", "handler", "due", "data", "every", "attempts")
+
+    def __init__(
+        self,
+        id: str,
+        handler: str,
+        due: datetime.datetime,
+        data: Optional[dict] = None,
+        every: Optional[float] = None,
+        attempts: int = 0,
+    ):
+        self.id = id
+        self.handler = handler
+        self.due = due
+        self.data = data or {}
+        self.every = every
+        self.attempts = attempts
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Job":
+        return cls(
+            document["_id"],
+            document["handler"],
+            document["due"],
+            document.get("data"),
+            document.get("every"),
+            document.get("attempts", 0),
+        )
+
+    def fields(self, cluster_id: int) -> dict:
+        """
+        Everything but the id, for a ``$set``.
+        """
+        return {
+            "handler": self.handler,
+            "due": self.due,
+            "data": self.data,
+            "every": self.every,
+            "attempts": self.attempts,
+            "cluster": cluster_id,
+        }
+
+    def __repr__(self) -> str:
+        return f"<Job {self.id} {self.handler} due {self.due.isoformat()}>"
+
+
+class HandlerStats:
+    __slots__ = ("ran", "failed", "skipped", "lag")
+
+    def __init__(self):
+        self.ran = 0
+        self.failed = 0
+        self.skipped = 0
+        self.lag = Histogram(LAG_BUCKETS)
+
+
+class Registered:
+    __slots__ = ("func", "catch_up", "grace")
+
+    def __init__(self, func: Handler, catch_up: bool, grace: Optional[float]):
+        self.func = func
+        self.catch_up = catch_up
+        self.grace = grace
+
+
+class JobScheduler:
+    """
+    Runs jobs at a given time, available as ``bot.scheduler``.
+
+    Jobs are kept in the jobs collection so they outlive restarts, and only the
+    ones due within ``lookahead`` seconds are held in memory, in a heap that one
+    task sleeps on until the earliest is due. Due jobs run their handler, at
+    most ``concurrency`` at once, the rest wait in the heap. A backlog is
+    loaded ``page_size`` jobs at a time, the next page once most of the last
+    one has run.
+
+    A job that was missed while rick was down still runs when it's loaded, unless
+    its handler was registered with ``catch_up=False`` and it's more than
+    ``grace`` seconds late. A repeating job then runs once and moves on to its
+    next time instead of running once for every time it missed.
+    """
+
+    def __init__(
+        self,
+        bot,
+        *,
+        lookahead: float = 3600,
+        concurrency: int = 10,
+        max_attempts: int = 3,
+        retry_delay: float = 60,
+        page_size: int = 1000
+    ):
+        self.bot = bot
+        self.lookahead = lookahead
+        self.concurrency = concurrency
+        # The most jobs loaded at once, a backlog after downtime is loaded a page at a time.
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self.handlers: Dict[str, Registered] = {}
+        self.handler_stats: Dict[str, HandlerStats] = {}
+        self.lag = Histogram(LAG_BUCKETS)
+
+        # (due, sequence, id), the sequence keeps jobs due at the same time in order.
+        self._heap: List[Tuple[datetime.datetime, int, str]] = []
+        self._jobs: Dict[str, Job] = {}
+        self._running: Set[str] = set()
+        self._sequence = 0
+        # Jobs due before this are all in the heap.
+        self._horizon: Optional[datetime.datetime] = None
+        # The (due, id) the next page is loaded after, the id is None after a whole window.
+        self._cursor: Optional[Tuple[datetime.datetime, Optional[str]]] = None
+        # Whether the last page was full, so there are more jobs before the end of the window.
+        self._more = False
+        # Bumped when everything has to be loaded again, so a load in flight is thrown away.
+        self._resets = 0
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, bot, config: SchedulerConfig) -> "JobScheduler":
+        return cls(
+            bot,
+            lookahead=config.lookahead,
+            concurrency=config.concurrency,
+            max_attempts=config.max_attempts,
+            retry_delay=config.retry_delay,
+        )
+
+    @property
+    def collection(self):
+        return self.bot.db["jobs"]
+
+    @property
+    def cluster_id(self) -> int:
+        return self.bot.ipc.cluster_id
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    # <--- Handlers --->
+
+    def register(self, name: str, func: Handler, *, catch_up: bool = True, grace: Optional[float] = None):
+        self.handlers[name] = Registered(func, catch_up, grace)
+        self.handler_stats.setdefault(name, HandlerStats())
+        # Jobs for it that were due while it wasn't registered are still in the collection.
+        self._horizon = None
+        self._cursor = None
+        self._resets += 1
+        self._wake()
+
+    def unregister(self, name: str):
+        self.handlers.pop(name, None)
+
+    def handler(self, name: str, **kwargs):
+        """
+        Registers the decorated function as a handler, for functions outside a cog.
+        """
+        def decorator(func: Handler) -> Handler:
+            self.register(name, func, **kwargs)
+            return func
+        return decorator
+
+    # <--- Jobs --->
+
+    async def schedule(
+        self,
+        handler: str,
+        when: Union[datetime.datetime, float],
+        data: Optional[dict] = None,
+        *,
+        every: Optional[float] = None,
+        job_id: Optional[str] = None
+    ) -> Job:
+        """
+        Stores a job for ``handler`` due at ``when``, a UTC datetime or seconds
+        from now, and every ``every`` seconds after that if given. Scheduling
+        with the ``job_id`` of an existing job replaces it.
+        """
+        if not isinstance(when, datetime.datetime):
+            when = datetime.datetime.utcnow() + datetime.timedelta(seconds=when)
+        elif when.tzinfo is not None:
+            when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+        job = Job(job_id or uuid.uuid4().hex, handler, when, data, every)
+        await self.collection.update_one(
+            {"_id": job.id}, {"$set": job.fields(self.cluster_id)}, upsert=True
+        )
+        self._add(job)
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        self._jobs.pop(job_id, None)
+        result = await self.collection.delete_one({"_id": job_id})
+        return result.deleted_count > 0
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        document = await self.collection.find_one({"_id": job_id})
+        return None if document is None else Job.from_document(document)
+
+    def _add(self, job: Job):
+        if self._horizon is None or job.due > self._horizon:
+            # Loaded when the window gets to it, a replaced job is dropped from the heap.
+            self._jobs.pop(job.id, None)
+            return
+        self._jobs[job.id] = job
+        self._sequence += 1
+        heapq.heappush(self._heap, (job.due, self._sequence, job.id))
+        if self._heap[0][2] == job.id:
+            self._wake()
+
+    def _needs_load(self, now: datetime.datetime) -> bool:
+        if self._horizon is None:
+            return True
+        if self._more:
+            # More of the backlog once most of the last page has run.
+            return len(self._jobs) < self.page_size // 2
+        # Reloaded halfway through the window so jobs are in the heap well before they're due.
+        return now >= self._horizon - datetime.timedelta(seconds=self.lookahead / 2)
+
+    async def _load(self, now: datetime.datetime):
+        end = now + datetime.timedelta(seconds=self.lookahead)
+        filter = {"cluster": self.cluster_id, "due": {"$lte": end}}
+        if self._cursor is not None:
+            due, job_id = self._cursor
+            if job_id is None:
+                filter["due"]["$gt"] = due
+            else:
+                filter["$or"] = [{"due": {"$gt": due}}, {"due": due, "_id": {"$gt": job_id}}]
+
+        resets = self._resets
+        documents = await self.collection.find(
+            filter, sort=[("due", 1), ("_id", 1)], limit=self.page_size
+        )
+        if resets != self._resets:
+            return
+        self._more = len(documents) >= self.page_size
+        if self._more:
+            last = documents[-1]
+            self._horizon = last["due"]
+            self._cursor = (last["due"], last["_id"])
+        else:
+            self._horizon = end
+            self._cursor = (end, None)
+
+        for document in documents:
+            if document["_id"] in self._running:
+                continue
+            job = Job.from_document(document)
+            known = self._jobs.get(job.id)
+            if known is None or known.due != job.due:
+                self._add(job)
+
+    # <--- Running --->
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        await self.collection.create_index([("cluster", 1), ("due", 1), ("_id", 1)])
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = datetime.datetime.utcnow()
+            if self._needs_load(now):
+                try:
+                    await self._load(now)
+                except Exception as error:
+                    self.bot.errors.report(error, "job scheduler load")
+                    self._horizon = None
+                    self._cursor = None
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+
+            # The rest wait in the heap, a job finishing wakes this up to start the next.
+            while self._heap and self._heap[0][0] <= now and len(self._running) < self.concurrency:
+                due, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                # Cancelled, replaced or rescheduled since it was pushed.
+                if job is None or job.due != due:
+                    continue
+                del self._jobs[job_id]
+                self._running.add(job_id)
+                asyncio.ensure_future(self._execute(job))
+
+            if self._needs_load(now):
+                # A handler was registered while loading, or the last page has mostly run.
+                continue
+
+            until = None
+            if self._heap and self._heap[0][0] > now:
+                until = self._heap[0][0]
+            if not self._more:
+                refill = self._horizon - datetime.timedelta(seconds=self.lookahead / 2)
+                until = refill if until is None else min(until, refill)
+
+            self._wakeup.clear()
+            timeout = None if until is None else max((until - now).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Job):
+        try:
+            await self._dispatch(job)
+        except Exception as error:
+            self.bot.errors.report(error, f"job scheduler {job.handler}")
+        finally:
+            self._running.discard(job.id)
+            self._wake()
+
+    async def _dispatch(self, job: Job):
+        registered = self.handlers.get(job.handler)
+        if registered is None:
+            # Left in the collection for when the extension is loaded.
+            log.debug(f"No handler is registered for {job!r}, it wasn't run")
+            return
+
+        stats = self.handler_stats[job.handler]
+        now = datetime.datetime.utcnow()
+        late = max((now - job.due).total_seconds(), 0.0)
+
+        if not registered.catch_up and registered.grace is not None and late > registered.grace:
+            stats.skipped += 1
+            await self._finish(job, now)
+            return
+
+        self.lag.observe(late)
+        stats.lag.observe(late)
+        try:
+            await registered.func(job)
+        except Exception as error:
+            stats.failed += 1
+            self.bot.errors.report(error, f"job {job.handler}")
+            if job.attempts + 1 < self.max_attempts:
+                job.attempts += 1
+                await self._reschedule(job, now + datetime.timedelta(seconds=self.retry_delay * job.attempts))
+                return
+        else:
+            stats.ran += 1
+        await self._finish(job, now)
+
+    async def _finish(self, job: Job, now: datetime.datetime):
+        if job.every is None:
+            await self.collection.delete_one({"_id": job.id, "due": job.due})
+            return
+
+        # Missed runs are skipped, the next one is the first still to come.
+        every = datetime.timedelta(seconds=job.every)
+        due = job.due + every
+        if due <= now:
+            due += every * ((now - due) // every + 1)
+        job.attempts = 0
+        await self._reschedule(job, due)
+
+    async def _reschedule(self, job: Job, due: datetime.datetime):
+        previous, job.due = job.due, due
+        # Only if it wasn't replaced or cancelled while it ran.
+        result = await self.collection.update_one(
+            {"_id": job.id, "due": previous}, {"$set": {"due": due, "attempts": job.attempts}}
+        )
+        if result.matched_count:
+            self._add(job)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._jobs),
+            "running": len(self._running),
+            "horizon": self._horizon,
+            "handlers": dict(self.handler_stats),
+            "lag": self.lag,
+        }
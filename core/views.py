@@ -0,0 +1,190 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple, Type
+
+import discord
+
+from utils import PersistentView, decode_custom_id
+
+from .config import ViewsConfig
+
+log = logging.getLogger("rickbot")
+
+
+class ViewRegistry:
+    """
+    Keeps track of the views rick has sent, available as ``bot.views``.
+
+    At most ``per_guild`` views are live in a guild and ``total`` overall, when
+    there are more the oldest are disabled and stopped so discord.py lets go of
+    them. Persistent views aren't kept at all: their buttons are routed by
+    custom_id to the registered type, which is loaded from the database for
+    the click.
+    """
+
+    def __init__(self, bot, *, per_guild: int = 25, total: int = 1000):
+        self.bot = bot
+        self.per_guild = per_guild
+        self.total = total
+        self.types: Dict[str, Type[PersistentView]] = {}
+
+        self._live: "OrderedDict[int, Tuple[discord.ui.View, discord.Message, Optional[int]]]" = OrderedDict()
+        self._guilds: Dict[Optional[int], "OrderedDict[int, None]"] = {}
+        # Edits disabling evicted views that haven't finished yet.
+        self._edits: Set[asyncio.Task] = set()
+
+        self.evicted = 0
+        self.rehydrated = 0
+        self.expired = 0
+
+    @classmethod
+    def from_config(cls, bot, config: ViewsConfig) -> "ViewRegistry":
+        return cls(bot, per_guild=config.per_guild, total=config.total)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    async def start(self):
+        # Clicks come in bursts on the same few messages.
+        self.bot.db.cache("views")
+        await self.bot.db["views"].create_index("expires", expireAfterSeconds=0)
+        self.bot.add_listener(self._on_interaction, "on_interaction")
+
+    def register(self, view: Type[PersistentView]) -> Type[PersistentView]:
+        """
+        Routes the buttons of a persistent view type, can be used as a decorator.
+        """
+        if not view.view_type or ":" in view.view_type:
+            raise ValueError(f"{view.__name__} needs a view_type without colons.")
+        existing = self.types.get(view.view_type)
+        if existing is not None and existing.__qualname__ != view.__qualname__:
+            raise ValueError(f"{existing.__name__} already uses the view type {view.view_type!r}.")
+        self.types[view.view_type] = view
+        return view
+
+    def unregister(self, view_type: str):
+        self.types.pop(view_type, None)
+
+    # <--- Live views --->
+
+    def track(self, view: discord.ui.View, message: discord.Message):
+        if isinstance(view, PersistentView):
+            # Clicks are routed to a new view, this one doesn't need to stay around.
+            view.stop()
+            return
+        if view.is_finished():
+            return
+
+        key = id(view)
+        guild_id = message.guild.id if message.guild else None
+        self._live[key] = (view, message, guild_id)
+        guild = self._guilds.setdefault(guild_id, OrderedDict())
+        guild[key] = None
+
+        # Forgotten as soon as it times out or is stopped, so it doesn't hold on
+        # to its message or count against the limits.
+        stopped = getattr(view, "_View__stopped", None)
+        if stopped is not None:
+            stopped.add_done_callback(lambda _: self._forget(key, view))
+
+        if len(guild) > self.per_guild:
+            self._prune(list(guild))
+            while len(guild) > self.per_guild:
+                self._evict(next(iter(guild)))
+        if len(self._live) > self.total:
+            self._prune(list(self._live))
+            while len(self._live) > self.total:
+                self._evict(next(iter(self._live)))
+
+    def _forget(self, key: int, view: Optional[discord.ui.View] = None):
+        entry = self._live.get(key)
+        # The id may belong to a newer view by now.
+        if entry is None or (view is not None and entry[0] is not view):
+            return
+        del self._live[key]
+        guild = self._guilds[entry[2]]
+        del guild[key]
+        if not guild:
+            del self._guilds[entry[2]]
+
+    def _prune(self, keys):
+        # For views whose stop can't be watched, finished ones are dropped before evicting live ones.
+        for key in keys:
+            if self._live[key][0].is_finished():
+                self._forget(key)
+
+    def _evict(self, key: int):
+        view, message, _ = self._live[key]
+        self._forget(key)
+        for item in view.children:
+            item.disabled = True
+        view.stop()
+        self.evicted += 1
+        task = asyncio.ensure_future(self._disable(message, view))
+        self._edits.add(task)
+        task.add_done_callback(self._edits.discard)
+
+    async def _disable(self, message: discord.Message, view: discord.ui.View):
+        try:
+            await message.edit(view=view)
+        except discord.HTTPException:
+            pass
+
+    def close(self):
+        self.bot.remove_listener(self._on_interaction, "on_interaction")
+        for task in self._edits:
+            task.cancel()
+
+    # <--- Persistent views --->
+
+    async def _on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+        decoded = decode_custom_id((interaction.data or {}).get("custom_id", ""))
+        if decoded is None:
+            return
+
+        view_type, key, action = decoded
+        cls = self.types.get(view_type)
+        if cls is None:
+            # The extension it belongs to isn't loaded.
+            return
+
+        view = await cls.load(self.bot, key)
+        if view is None:
+            self.expired += 1
+            await interaction.response.send_message("This has expired.", ephemeral=True)
+            return
+
+        item = view.find_item(action)
+        if item is None:
+            return
+
+        self.rehydrated += 1
+        try:
+            if not await view.interaction_check(interaction):
+                return
+            # Selects read what was picked from the interaction.
+            if hasattr(item, "refresh_state"):
+                item.refresh_state(interaction)
+            elif hasattr(item, "_refresh_state"):
+                item._refresh_state(interaction.data)
+            await item.callback(interaction)
+        except Exception as error:
+            self.bot.errors.report(error, f"view {view_type} {action}")
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._live),
+            "guilds": len(self._guilds),
+            "types": len(self.types),
+            "evicted": self.evicted,
+            "rehydrated": self.rehydrated,
+            "expired": self.expired,
+        }
@@ -0,0 +1,235 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import importlib
+import logging
+import os
+import struct
+import sys
+from typing import Dict, Optional, Set
+
+from discord.ext import commands
+
+log = logging.getLogger("rickbot")
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    return libc
+
+
+class ReloadWatcher:
+    """
+    Watches the cogs, features and helpers folders and reloads what changed.
+
+    Uses inotify on Linux and polls modification times everywhere else. Changes
+    are debounced, so something like a git pull touching many files results in
+    one reload pass, and every extension that imports a changed helper is
+    reloaded along with it.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        folders=("cogs", "features", "helpers"),
+        *,
+        debounce: float = 1.0,
+        poll_interval: float = 1.0
+    ):
+        self.bot = bot
+        self.folders = folders
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self._pending: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._reloading: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._inotify_fd: Optional[int] = None
+        self._watches: Dict[int, str] = {}
+
+    # <--- Watching --->
+
+    def start(self):
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._inotify_fd = fd
+                for folder in self.folders:
+                    if os.path.isdir(folder):
+                        wd = libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK)
+                        if wd >= 0:
+                            self._watches[wd] = folder
+                self.bot.loop.add_reader(fd, self._read_inotify)
+                log.info(f"Watching {', '.join(self._watches.values())} for changes with inotify")
+                return
+
+        self._poller = self.bot.loop.create_task(self._poll())
+        log.info(f"Watching {', '.join(self.folders)} for changes by polling")
+
+    def stop(self):
+        if self._inotify_fd is not None:
+            self.bot.loop.remove_reader(self._inotify_fd)
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+
+    def _read_inotify(self):
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, _mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if wd in self._watches and name.endswith(".py"):
+                self._changed(os.path.join(self._watches[wd], name))
+
+    async def _poll(self):
+        def scan():
+            found = {}
+            for folder in self.folders:
+                if os.path.isdir(folder):
+                    for file in os.listdir(folder):
+                        if file.endswith(".py"):
+                            path = os.path.join(folder, file)
+                            try:
+                                found[path] = os.stat(path).st_mtime_ns
+                            except FileNotFoundError:
+                                pass
+            return found
+
+        seen = scan()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = scan()
+            for path in seen.keys() ^ current.keys():
+                self._changed(path)
+            for path in seen.keys() & current.keys():
+                if seen[path] != current[path]:
+                    self._changed(path)
+            seen = current
+
+    def _changed(self, path: str):
+        self._pending.add(os.path.normpath(path))
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = self.bot.loop.call_later(self.debounce, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._reloading is not None and not self._reloading.done():
+            # A pass is already running, try again once it has finished.
+            self._flush_handle = self.bot.loop.call_later(self.debounce, self._flush)
+            return
+
+        paths, self._pending = self._pending, set()
+        self._reloading = self.bot.loop.create_task(self.reload(paths))
+
+    # <--- Reloading --->
+
+    async def reload(self, paths: Set[str]):
+        changed_modules = {os.path.splitext(path)[0].replace(os.sep, "."): path for path in paths}
+        extensions = set()
+
+        for module_name, path in sorted(changed_modules.items()):
+            if module_name.startswith("helpers."):
+                if module_name in sys.modules and os.path.exists(path):
+                    if not self._reload_helper(module_name):
+                        continue
+                extensions.update(self.dependents(module_name))
+            else:
+                extensions.add(module_name)
+
+        for extension in sorted(extensions):
+            self._reload_extension(extension)
+
+    def dependents(self, module_name: str) -> Set[str]:
+        found = set()
+        for extension in list(self.bot.extensions) + list(self.bot.lazy.pending):
+            path = f"./{extension.replace('.', '/')}.py"
+            if not os.path.exists(path):
+                continue
+            imports = self.bot.manifests.get(path).imports
+            if any(module == module_name or module.startswith(f"{module_name}.") for module in imports):
+                found.add(extension)
+        return found
+
+    def _reload_helper(self, module_name: str) -> bool:
+        module = sys.modules[module_name]
+        previous = dict(module.__dict__)
+        try:
+            importlib.reload(module)
+        except Exception:
+            # reload() updates the module in place, so put the old namespace back.
+            module.__dict__.clear()
+            module.__dict__.update(previous)
+            log.exception(f"Reloading {module_name} failed, kept the previous version")
+            return False
+        log.info(f"Reloaded helper {module_name}")
+        return True
+
+    def _reload_extension(self, extension: str):
+        path = f"./{extension.replace('.', '/')}.py"
+        exists = os.path.exists(path)
+
+        try:
+            if extension in self.bot.lazy.pending:
+                # Not imported yet, just register stubs for the new command names.
+                self.bot.lazy.discard(extension)
+                if exists and not self.bot.lazy.defer(extension, self.bot.manifests.get(path)):
+                    self.bot.load_extension(extension)
+            elif extension in self.bot.extensions:
+                if exists:
+                    # Rolls back to the previous module by itself if the new one fails.
+                    self.bot.reload_extension(extension)
+                else:
+                    self.bot.unload_extension(extension)
+            elif exists:
+                self.bot.load_extension(extension)
+            else:
+                return
+        except commands.ExtensionError:
+            log.exception(f"Reloading {extension} failed, kept the previous version")
+            return
+
+        folder, _, name = extension.partition(".")
+        if folder in self.bot.loaded:
+            if exists and name not in self.bot.loaded[folder]:
+                self.bot.loaded[folder].append(name)
+            elif not exists and name in self.bot.loaded[folder]:
+                self.bot.loaded[folder].remove(name)
+
+        log.info(f"Reloaded {extension}")
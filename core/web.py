@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import json
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from yarl import URL
+
+from utils import TTLCache
+
+from .config import WebConfig
+from .database import OperationStats
+
+
+def _cache_key(url: str, kwargs: dict) -> tuple:
+    """
+    What makes two GETs the same request: the URL with its query, and the
+    headers, auth and cookies, so a response is never shared with a request
+    made with other credentials.
+    """
+    full = URL(url)
+    params = kwargs.get("params")
+    if params:
+        full = full.update_query(params)
+
+    headers = kwargs.get("headers") or {}
+    auth = kwargs.get("auth")
+    cookies = kwargs.get("cookies") or {}
+    return (
+        str(full),
+        tuple(sorted((str(name).lower(), str(value)) for name, value in headers.items())),
+        tuple(auth) if auth is not None else None,
+        tuple(sorted((str(name), str(value)) for name, value in cookies.items())),
+    )
+
+
+class CachedResponse:
+    """
+    The parts of a response that are kept in the cache.
+    """
+
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding)
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class WebClient:
+    """
+    The one HTTP session every cog shares, available as ``bot.web`` and ``bot.session``.
+
+    Connections are pooled with a total and a per host limit and DNS lookups
+    are cached. ``get`` can cache the responses of idempotent requests, and
+    latency is recorded per host along with how often a request had to wait
+    for a free connection.
+    """
+
+    def __init__(
+        self,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        dns_ttl: int = 300,
+        timeout: float = 30,
+        connect_timeout: float = 10,
+        cache_size: int = 1024,
+        cache_ttl: float = 60
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.hosts: Dict[str, OperationStats] = {}
+        self.queued = 0
+        self.queue_time = 0.0
+
+    @classmethod
+    def from_config(cls, config: WebConfig) -> "WebClient":
+        return cls(
+            limit=config.limit,
+            limit_per_host=config.limit_per_host,
+            dns_ttl=config.dns_ttl,
+            timeout=config.timeout,
+            connect_timeout=config.connect_timeout,
+            cache_size=config.cache_size,
+            cache_ttl=config.cache_ttl,
+        )
+
+    def connect(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request_start)
+            trace.on_request_end.append(self._on_request_end)
+            trace.on_request_exception.append(self._on_request_exception)
+            trace.on_connection_queued_start.append(self._on_queued_start)
+            trace.on_connection_queued_end.append(self._on_queued_end)
+
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl
+                ),
+                timeout=self.timeout,
+                trace_configs=[trace],
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def get(self, url: str, *, cache: bool = False, ttl: Optional[float] = None, **kwargs) -> CachedResponse:
+        """
+        A GET that reads the whole body, with ``cache`` the response is reused
+        for ``ttl`` seconds (``[WEB] cache_ttl`` by default) if it was a success.
+        """
+        key = _cache_key(url, kwargs)
+        if cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        async with self.session.get(url, **kwargs) as response:
+            result = CachedResponse(response.status, dict(response.headers), await response.read())
+
+        if cache and 200 <= result.status < 300:
+            self.cache.set(key, result, ttl)
+        return result
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        response = await self.get(url, **kwargs)
+        return response.json()
+
+    # <--- Tracing --->
+
+    async def _on_request_start(self, _session, context: SimpleNamespace, params):
+        context.host = urlsplit(str(params.url)).hostname
+        context.start = time.perf_counter()
+
+    def _record(self, context: SimpleNamespace, failed: bool):
+        stats = self.hosts.get(context.host)
+        if stats is None:
+            stats = self.hosts[context.host] = OperationStats()
+        stats.record(time.perf_counter() - context.start, failed)
+
+    async def _on_request_end(self, _session, context: SimpleNamespace, params):
+        self._record(context, params.response.status >= 500)
+
+    async def _on_request_exception(self, _session, context: SimpleNamespace, _params):
+        self._record(context, True)
+
+    async def _on_queued_start(self, _session, context: SimpleNamespace, _params):
+        context.queued_at = time.perf_counter()
+        self.queued += 1
+
+    async def _on_queued_end(self, _session, context: SimpleNamespace, _params):
+        self.queue_time += time.perf_counter() - context.queued_at
+
+    def stats(self) -> dict:
+        connector = self.session.connector if self.session is not None else None
+        return {
+            "in_use": len(getattr(connector, "_acquired", ())) if connector else 0,
+            "limit": self.limit,
+            "queued": self.queued,
+            "queue_time": self.queue_time,
+            "hosts": self.hosts,
+            "cache": self.cache.stats(),
+        }
@@ -3,9 +3,21 @@
 from importlib import import_module
 from pathlib import Path
 
-for f in Path(__file__).parent.glob("*.py"):
-    module_name = f.stem
-    if (not module_name.startswith("_")) and (module_name not in globals()):
-        import_module(f".{module_name}", __package__)
-    del f, module_name
-del import_module, Path
+from core.config import config_manager as _config_manager
+
+if _config_manager.current.rick.lazy_load:
+    # With lazy loading helpers are only imported the first time they're used.
+    _import_module, _directory = import_module, Path(__file__).parent
+
+    def __getattr__(name):
+        if name.startswith("_") or not (_directory / f"{name}.py").exists():
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        return _import_module(f".{name}", __package__)
+
+else:
+    for f in Path(__file__).parent.glob("*.py"):
+        module_name = f.stem
+        if (not module_name.startswith("_")) and (module_name not in globals()):
+            import_module(f".{module_name}", __package__)
+        del f, module_name
+del import_module, Path, _config_manager
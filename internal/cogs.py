@@ -4,140 +4,227 @@ All rights reserved.
 """
 
 from configparser import ConfigParser
-from git.repo.base import Repo
+from git.exc import GitCommandError
 from os.path import exists
 import configparser
-import asyncio
+import functools
+import logging
 import shutil
-import uuid
 import json
-import traceback
 import glob
 import os
 
 from discord.ext import commands
 from discord.ext.commands import check
 
-from utils import bot_owner, cb_reply, cb_reply_edit, rmtree_error
+from utils import bot_owner, cb_reply, Timer, ProgressReporter
+
+from core.config import ConfigError
+from internal.repocache import RepoCache
+
+log = logging.getLogger("rickbot")
+
+
+class InstallError(Exception):
+    """
+    Raised by an install stage, the message is shown to the user.
+    """
+
+
+# <--- Install stages, these block and are run in the executor --->
+
+def fetch_repo(cache: RepoCache, github_repo: str, offline: bool) -> str:
+    # A commit can be pinned with "url#commit", pinned commits that are
+    # already cached are installed without touching the network.
+    github_repo, _, commit = github_repo.partition("#")
+    try:
+        return cache.fetch(github_repo, commit or None, offline=offline).path
+    except LookupError:
+        raise InstallError("This repo hasn't been downloaded before so it can't be installed offline.")
+    except ValueError:
+        raise InstallError("Pin the full commit hash, short hashes only work for commits that were installed before.")
+    except GitCommandError:
+        if commit:
+            raise InstallError("The repo or the pinned commit could not be downloaded, check the url and commit and try again.")
+        raise InstallError("The repo could not be downloaded, check the url and try again.")
+
+
+def read_metadata(repo_path: str) -> dict:
+    if not exists(f"{repo_path}/metadata.json"):
+        raise InstallError("This repo is not a cog/feature or it isn't formatted correctly.")
+
+    elif not exists(f"{repo_path}/cog.py") and not exists(f"{repo_path}/feature.py"):
+        raise InstallError("This repo is not a cog/feature or it isn't formatted correctly.")
+
+    with open(f"{repo_path}/metadata.json") as f:
+        try:
+            repo_metadata = json.load(f)
+        except json.decoder.JSONDecodeError:
+            raise InstallError("The metadata cannot be decoded.")
+        except Exception as error:
+            log.exception(f"Failed to read the metadata in {repo_path}", exc_info=error)
+            raise InstallError("Something went wrong while reading the metadata, this is an error with me. Please see the console for more information.")
+
+    for i in ["name", "raw_name", "author", "type"]:
+        if i not in repo_metadata:
+            raise InstallError("The metadata is not formatted correctly.")
+
+    if repo_metadata["type"] not in ("cog", "feature"):
+        raise InstallError("The metadata is not formatted correctly.")
+
+    return repo_metadata
+
+
+def install_files(repo_path: str, repo_metadata: dict) -> dict:
+    repo_installed = {
+        "helpers": []
+    }
+
+    if "config" in repo_metadata:
+        if not exists("./configs"):
+            os.mkdir("./configs")
+
+        configp = ConfigParser()
+        configp.read(f"./configs/{repo_metadata['raw_name']}.ini")
+        for config_entry in repo_metadata["config"]:
+            try:
+                configp.add_section(config_entry.upper())
+            except configparser.DuplicateSectionError:
+                pass
+
+            for config_entry_data in repo_metadata["config"][config_entry]:
+                configp.set(config_entry.upper(), config_entry_data,
+                            repo_metadata["config"][config_entry][config_entry_data])
+
+        with open(f"./configs/{repo_metadata['raw_name']}.ini", 'w+') as configfile:
+            configp.write(configfile)
+
+    if exists(f"{repo_path}/helpers"):
+        for helper in glob.glob(f"{repo_path}/helpers/*.py"):
+            shutil.copy2(helper, f"./helpers/{os.path.basename(helper)}")
+            repo_installed["helpers"].append(os.path.basename(helper)[:-3])
+
+    if repo_metadata["type"] == "feature":
+        folder = "features"
+        shutil.copy2(f"{repo_path}/feature.py", f"./features/{repo_metadata['raw_name']}.py")
+    else:
+        folder = "cogs"
+        shutil.copy2(f"{repo_path}/cog.py", f"./cogs/{repo_metadata['raw_name']}.py")
+    repo_installed["cog/feature"] = repo_metadata["raw_name"]
+
+    # Kept next to the extension, the loader reads "requires" from it on startup.
+    with open(f"./{folder}/{repo_metadata['raw_name']}.json", "w") as f:
+        json.dump(dict(repo_metadata, helpers=repo_installed["helpers"]), f, indent=4)
+
+    return repo_installed
 
 
 class CogInstaller(commands.Cog):
     def __init__(self, client):
         self.client = client
+        self.cache = RepoCache(client.config.cache.path, client.config.cache.max_size * 1024 * 1024)
+
+    async def run_stage(self, progress: ProgressReporter, status: str, func, *args):
+        """
+        Updates the status message and then runs a blocking stage in the executor,
+        returns the result of the stage and how long it took.
+        """
+        progress.update(status)
+        with Timer() as timer:
+            result = await self.client.loop.run_in_executor(None, functools.partial(func, *args))
+        return result, timer.time
 
     @commands.command(name="install")
     @check(bot_owner)
-    async def _install(self, ctx, github_repo: str = None):
+    async def _install(self, ctx, github_repo: str = None, mode: str = None):
         if github_repo is None:
             await cb_reply(ctx, "You need to provide a repo to install")
             return
 
-        repo_temp_uuid = uuid.uuid4()
-        repo_path = f"./cache/{repo_temp_uuid}"
-
-        async with ctx.typing():
-            reply = await cb_reply(ctx, "Downloading...")
-            Repo.clone_from(github_repo, repo_path)
-
-        if not exists(f"{repo_path}/metadata.json"):
-            await cb_reply_edit(reply, "This repo is not a cog/feature or it isn't formatted correctly.")
-            await self.delete_repo(repo_path)
-            return
-
-        elif not exists(f"{repo_path}/cog.py") and not exists(f"{repo_path}/feature.py"):
-            await cb_reply_edit(reply, "This repo is not a cog/feature or it isn't formatted correctly.")
-            await self.delete_repo(repo_path)
-            return
+        offline = mode is not None and mode.lower() in ("offline", "--offline")
+        timings = {}
 
-        with open(f"{repo_path}/metadata.json") as f:
-            try:
-                repo_metadata = json.load(f)
-                f.close()
-            except json.decoder.JSONDecodeError:
-                f.close()
-                await cb_reply_edit(reply, "The metadata cannot be decoded.")
-                await self.delete_repo(repo_path)
-                return
-
-            except Exception as error:
-                f.close()
-                await cb_reply_edit(reply, "Something went wrong while reading the metadata, this is an error with me. Please see the console for more information.")
-                print(traceback.format_exception(error))
-                await self.delete_repo(repo_path)
-                return
+        progress = await ctx.progress("Downloading...")
 
         try:
-            for i in ["name", "raw_name", "author", "type"]:
-                _ = repo_metadata[i]
-            del _
-        except KeyError:
-            await cb_reply_edit(reply, "The metadata is not formatted correctly.")
-            await self.delete_repo(repo_path)
-            return
-
-        async with ctx.typing():
-            await cb_reply_edit(reply, f"Installing '{repo_metadata['name']}' By '{repo_metadata['author']}'")
-
-            repo_installed = {
-                "helpers": []
-            }
-
-            if "config" in repo_metadata:
-                if not exists("./configs"):
-                    os.mkdir("./configs")
+            async with ctx.typing():
+                repo_path, timings["download"] = await self.run_stage(
+                    progress, "Using the cached download..." if offline else "Downloading...",
+                    fetch_repo, self.cache, github_repo, offline
+                )
+                repo_metadata, timings["validate"] = await self.run_stage(
+                    progress, "Reading metadata...", read_metadata, repo_path
+                )
+
+                folder = "features" if repo_metadata["type"] == "feature" else "cogs"
+                extension = f"{folder}.{repo_metadata['raw_name']}"
+                if extension in self.client.extensions:
+                    raise InstallError("A feature/cog with the same name has already been installed.")
+
+                repo_installed, timings["copy"] = await self.run_stage(
+                    progress,
+                    f"Installing '{repo_metadata['name']}' By '{repo_metadata['author']}'",
+                    install_files, repo_path, repo_metadata
+                )
+
+                if "config" in repo_metadata:
+                    # So the extension sees its config as soon as it is loaded.
+                    try:
+                        self.client.config_manager.reload()
+                    except ConfigError as error:
+                        raise InstallError(f"'{repo_metadata['name']}' was installed but the config couldn't be reloaded: {error}")
 
-                configp = ConfigParser()
-                configp.read(f"./configs/{repo_metadata['raw_name']}.ini")
-                for config_entry in repo_metadata["config"]:
+                progress.update(f"Loading '{repo_metadata['name']}'...")
+                with Timer() as timer:
                     try:
-                        configp.add_section(config_entry.upper())
-                    except configparser.DuplicateSectionError:
-                        pass
-
-                    for config_entry_data in repo_metadata["config"][config_entry]:
-                        configp.set(config_entry.upper(), config_entry_data,
-                                    repo_metadata["config"][config_entry][config_entry_data])
-
-                with open(f"./configs/{repo_metadata['raw_name']}.ini", 'w+') as configfile:
-                    configp.write(configfile)
-
-            if exists(f"{repo_path}/helpers"):
-                for helper in glob.glob(f"{repo_path}/helpers/*.py"):
-                    shutil.move(helper, f"./helpers/{os.path.basename(helper)}")
-                    repo_installed["helpers"].append(os.path.basename(helper)[:-3])
-
-            if repo_metadata["type"] == "feature":
-                shutil.move(f"{repo_path}/feature.py", f"./features/{repo_metadata['raw_name']}.py")
-                try:
-                    self.client.load_extension(f"features.{repo_metadata['raw_name']}")
-                except:
-                    await cb_reply_edit(reply, "A feature/cog with the same name has already been installed.")
-                    await self.delete_repo(repo_path)
-                    return
-                repo_installed["cog/feature"] = repo_metadata["raw_name"]
-
-            elif repo_metadata["type"] == "cog":
-                shutil.move(f"{repo_path}/cog.py", f"./cogs/{repo_metadata['raw_name']}.py")
-                try:
-                    self.client.load_extension(f"cogs.{repo_metadata['raw_name']}")
-                except:
-                    await cb_reply_edit(reply, "A feature/cog with the same name has already been installed.")
-                    await self.delete_repo(repo_path)
-                    return
-                repo_installed["cog/feature"] = repo_metadata["raw_name"]
-
-            repo_install_info = "Helpers:\n"
-            for helper in repo_installed["helpers"]:
-                repo_install_info += f"- {helper}\n"
-            repo_install_info += f"\nCog/Feature:\n- {repo_installed['cog/feature']}"
-
-        await cb_reply_edit(reply, f"Installed '{repo_metadata['name']}' By '{repo_metadata['author']}'\n\nInstall information:\n{repo_install_info}")
-        await self.delete_repo(repo_path)
-
-    async def delete_repo(self, path: str):
-        await asyncio.sleep(2)
-        shutil.rmtree(path, onerror=rmtree_error)
-        return
+                        self.client.load_extension(extension)
+                    except commands.ExtensionError as error:
+                        log.exception(f"Failed to load {extension}", exc_info=error)
+                        raise InstallError(f"'{repo_metadata['name']}' was installed but failed to load, see the console for more information.")
+                timings["load"] = timer.time
+                self.client.loaded[folder].append(repo_metadata["raw_name"])
+
+                if self.client.ipc.cluster_count > 1:
+                    # The files are shared, the other clusters only have to load it.
+                    progress.update(f"Loading '{repo_metadata['name']}' on every cluster...")
+                    if "config" in repo_metadata:
+                        await self.client.ipc.broadcast("reload_config")
+                    await self.client.ipc.broadcast("load_extension", extension)
+
+        except InstallError as error:
+            await progress.finish(str(error))
+            return
+
+        self.client.metrics.record_install(timings)
+        total = sum(timings.values())
+        log.info(
+            f"Installed {extension} in {total:.2f}s ("
+            + ", ".join(f"{stage} {taken:.2f}s" for stage, taken in timings.items())
+            + ")"
+        )
+
+        repo_install_info = "Helpers:\n"
+        for helper in repo_installed["helpers"]:
+            repo_install_info += f"- {helper}\n"
+        repo_install_info += f"\nCog/Feature:\n- {repo_installed['cog/feature']}"
+        repo_install_info += f"\n\nTook {total:.2f}s"
+
+        manifest = self.client.manifests.get(f"./{folder}/{repo_metadata['raw_name']}.py")
+        missing = sorted(
+            name for name in set(manifest.intents + repo_metadata.get("intents", []))
+            if not getattr(self.client.intents, name, True)
+        )
+        if missing:
+            repo_install_info += f"\n\nRestart me to enable the {', '.join(missing)} intents it needs."
+
+        await progress.finish(f"Installed '{repo_metadata['name']}' By '{repo_metadata['author']}'\n\nInstall information:\n{repo_install_info}")
+
+    @commands.command(name="clearcache")
+    @check(bot_owner)
+    async def _clear_cache(self, ctx):
+        size = self.cache.size
+        await self.client.loop.run_in_executor(None, self.cache.clear)
+        await cb_reply(ctx, f"Cleared {size / 1024 / 1024:.1f}MB of cached repos.")
 
 
 def setup(client):
@@ -0,0 +1,249 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import datetime
+
+import discord
+from discord.ext import commands
+from discord.ext.commands import check
+
+from core.config import ConfigError
+from utils import bot_owner, cb_reply, e_reply, plural, PageSource, PaginatedView
+
+
+class Owner(commands.Cog):
+    _hide_from_help = True
+
+    def __init__(self, client):
+        self.client = client
+
+    @commands.command(name="dbstats")
+    @check(bot_owner)
+    async def _db_stats(self, ctx):
+        lines = []
+
+        for name, stats in self.client.db.cache_stats().items():
+            lines.append(
+                f"{name} cache: {stats['size']}/{stats['max_size']} entries, "
+                f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+                f"{stats['evictions']} evictions"
+            )
+
+        buffer = self.client.db.buffer.stats()
+        if buffer["flushes"] or buffer["depth"]:
+            lines.append(
+                f"write buffer: {buffer['depth']} waiting, {buffer['flushes']} flushes "
+                f"({buffer['failed_flushes']} failed), avg {buffer['average_flush'] * 1000:.1f}ms, "
+                f"max {buffer['max_flush'] * 1000:.1f}ms, last batch {buffer['last_batch_size']}, "
+                f"largest {buffer['largest_batch_size']}, {buffer['writes_merged']} writes merged"
+            )
+
+        if lines:
+            lines.append("")
+
+        for name, operations in self.client.db.stats().items():
+            for operation, stats in operations.items():
+                lines.append(
+                    f"{name}.{operation}: {stats.count} calls, {stats.errors} errors, "
+                    f"avg {stats.average * 1000:.1f}ms, max {stats.max * 1000:.1f}ms"
+                )
+
+        if not lines:
+            await cb_reply(ctx, "The database hasn't been used yet.")
+            return
+
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="webstats")
+    @check(bot_owner)
+    async def _web_stats(self, ctx):
+        stats = self.client.web.stats()
+        cache = stats["cache"]
+        lines = [
+            f"pool: {stats['in_use']}/{stats['limit']} connections in use, "
+            f"{stats['queued']} requests waited for a connection ({stats['queue_time']:.2f}s in total)",
+            f"cache: {cache['size']} responses, {cache['hits']} hits, {cache['misses']} misses ({cache['hit_rate']:.0%})",
+            "",
+        ]
+        for host, host_stats in sorted(stats["hosts"].items(), key=lambda item: -item[1].count):
+            lines.append(
+                f"{host}: {host_stats.count} requests, {host_stats.errors} errors, "
+                f"avg {host_stats.average * 1000:.1f}ms, max {host_stats.max * 1000:.1f}ms"
+            )
+
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="intents")
+    @check(bot_owner)
+    async def _intents(self, ctx):
+        budget = self.client.intent_budget
+        lines = [f"{name}: {', '.join(sources)}" for name, sources in sorted(budget.sources.items())]
+        lines.append("")
+        lines.append(f"disabled: {', '.join(budget.disabled) or 'none'}")
+        lines.append(
+            "member cache: "
+            + (", ".join(name for name, enabled in budget.member_cache_flags if enabled) or "none")
+        )
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="clusters")
+    @check(bot_owner)
+    async def _clusters(self, ctx):
+        results = await self.client.ipc.broadcast("stats")
+        lines = []
+        for cluster_id in range(self.client.ipc.cluster_count):
+            stats = results.get(cluster_id)
+            if stats is None:
+                lines.append(f"cluster {cluster_id}: no answer")
+            elif isinstance(stats, Exception):
+                lines.append(f"cluster {cluster_id}: {stats}")
+            else:
+                shards = stats["shards"]
+                lines.append(
+                    f"cluster {cluster_id}: shards {shards[0]}-{shards[-1]}, {stats['guilds']} guilds, "
+                    f"{stats['latency'] * 1000:.0f}ms, {stats['messages']['dispatched']} commands dispatched"
+                )
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="sendstats")
+    @check(bot_owner)
+    async def _send_stats(self, ctx):
+        stats = self.client.outbound.stats()
+        lines = [
+            f"sent: {stats['sent']} messages, {stats['failed']} failed, {stats['coalesced']} coalesced into others",
+            f"queue: {stats['queued']} waiting in {stats['channels']} channels, "
+            f"avg wait {stats['average_wait'] * 1000:.1f}ms, max {stats['max_wait'] * 1000:.1f}ms",
+            f"replies: {stats['references_dropped']} sent without the reply, {stats['reference_fallbacks']} retried",
+            f"429s: {stats['rate_limits']} ({stats['global_rate_limits']} global)",
+        ]
+        await e_reply(ctx, "```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command(name="jobs")
+    @check(bot_owner)
+    async def _jobs(self, ctx):
+        stats = self.client.scheduler.stats()
+        lag = stats["lag"]
+        lines = [
+            f"{stats['pending']} jobs due in the next {plural(round(self.client.scheduler.lookahead / 60), 'minute')}, "
+            f"{stats['running']} running",
+            f"lag: p50 {lag.quantile(0.5):.2f}s, p99 {lag.quantile(0.99):.2f}s, avg {lag.average:.2f}s",
+            "",
+        ]
+        for name, handler in sorted(stats["handlers"].items()):
+            lines.append(
+                f"{name}: {handler.ran} ran, {handler.failed} failed, {handler.skipped} skipped, "
+                f"p99 lag {handler.lag.quantile(0.99):.2f}s"
+            )
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="reloadconfig")
+    @check(bot_owner)
+    async def _reload_config(self, ctx):
+        if self.client.ipc.cluster_count > 1:
+            results = await self.client.ipc.broadcast("reload_config")
+            lines = []
+            for cluster_id in range(self.client.ipc.cluster_count):
+                changed = results.get(cluster_id)
+                if changed is None:
+                    lines.append(f"cluster {cluster_id}: no answer")
+                elif isinstance(changed, Exception):
+                    lines.append(f"cluster {cluster_id}: {changed}")
+                else:
+                    lines.append(f"cluster {cluster_id}: {', '.join(changed) or 'nothing changed'}")
+            await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+            return
+
+        try:
+            changed = self.client.config_manager.reload()
+        except ConfigError as error:
+            await cb_reply(ctx, f"The config wasn't reloaded, {error}")
+            return
+
+        if not changed:
+            await cb_reply(ctx, "Reloaded the config, nothing changed.")
+        else:
+            await cb_reply(ctx, f"Reloaded the config, changed: {', '.join(sorted(changed))}")
+
+    @commands.command(name="stats")
+    @check(bot_owner)
+    async def _stats(self, ctx, count: int = 15):
+        metrics = self.client.metrics
+        lines = [
+            f"{'command':<20} {'calls':>6} {'errors':>6} {'p50':>8} {'p99':>8} {'parse':>7} {'prepare':>7} {'body':>7}"
+        ]
+        by_calls = sorted(metrics.commands.items(), key=lambda item: -item[1].count)[:count]
+        for name, command in by_calls:
+            phases = command.phases
+            lines.append(
+                f"{name[:20]:<20} {command.count:>6} {command.errors:>6} "
+                f"{command.latency.quantile(0.5) * 1000:>6.1f}ms {command.latency.quantile(0.99) * 1000:>6.1f}ms "
+                f"{phases['parse'].average * 1000:>5.1f}ms {phases['prepare'].average * 1000:>5.1f}ms "
+                f"{phases['body'].average * 1000:>5.1f}ms"
+            )
+        if not by_calls:
+            lines.append("no commands yet")
+
+        lines.append("")
+        top_events = sorted(metrics.events.items(), key=lambda item: -item[1])[:5]
+        lines.append(
+            f"gateway: {metrics.event_rate():.1f} events/s, "
+            + ", ".join(f"{name} {total}" for name, total in top_events)
+        )
+        lines.append(
+            f"loop lag: last {metrics.last_lag * 1000:.1f}ms, p99 {metrics.loop_lag.quantile(0.99) * 1000:.1f}ms, "
+            f"avg {metrics.loop_lag.average * 1000:.2f}ms"
+        )
+        if metrics.install_stages:
+            lines.append(
+                "installs: "
+                + ", ".join(
+                    f"{stage} avg {histogram.average:.2f}s p99 {histogram.quantile(0.99):.2f}s"
+                    for stage, histogram in metrics.install_stages.items()
+                )
+            )
+        await e_reply(ctx, "```\n" + "\n".join(lines)[:4000] + "\n```")
+
+    @commands.command(name="errors")
+    @check(bot_owner)
+    async def _errors(self, ctx):
+        groups = self.client.errors.groups()
+        if not groups:
+            await cb_reply(ctx, "No errors have happened.")
+            return
+
+        pages = []
+        for number, group in enumerate(groups, start=1):
+            embed = ctx.embed(
+                title=f"{group.type}: {group.message}"[:256],
+                timestamp=datetime.datetime.fromtimestamp(group.last_seen, datetime.timezone.utc),
+            )
+            embed.add_field(name="Count", value=str(group.count))
+            embed.add_field(name="First seen", value=discord.utils.format_dt(
+                datetime.datetime.fromtimestamp(group.first_seen, datetime.timezone.utc), "R"
+            ))
+            embed.add_field(name="Fingerprint", value=f"`{group.fingerprint}`")
+            embed.add_field(name="Where", value=f"`{group.location}`"[:1024], inline=False)
+            embed.add_field(name="Last from", value=group.context[:1024], inline=False)
+            if group.traceback:
+                embed.description = "```py\n" + group.traceback[-3900:] + "```"
+            embed.set_footer(text=f"Error {number}/{len(groups)}")
+            pages.append(embed)
+
+        await PaginatedView(PageSource(pages)).send_initial_message(ctx)
+
+    @commands.command(name="helpstats")
+    @check(bot_owner)
+    async def _help_stats(self, ctx):
+        stats = self.client.help_cache.stats()
+        await cb_reply(
+            ctx,
+            f"{stats['size']} help pages cached, {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}). {stats['renders']} renders, avg {stats['average_render'] * 1000:.2f}ms, "
+            f"max {stats['max_render'] * 1000:.2f}ms",
+        )
+
+
+def setup(client):
+    client.add_cog(Owner(client))
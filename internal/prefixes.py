@@ -0,0 +1,53 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+from discord.ext import commands
+
+from utils import cb_reply
+
+MAX_PREFIXES = 10
+MAX_PREFIX_LENGTH = 15
+
+
+class Prefixes(commands.Cog):
+    def __init__(self, client):
+        self.client = client
+
+    @commands.group(name="prefix", invoke_without_command=True)
+    @commands.guild_only()
+    async def _prefix(self, ctx):
+        mentions = self.client.prefixes.mentions
+        prefixes = [p for p in await self.client.prefixes.get(ctx.guild.id) if p not in mentions]
+        await cb_reply(ctx, f"My prefixes here are: {', '.join(prefixes)}")
+
+    @_prefix.command(name="set")
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def _prefix_set(self, ctx, *prefixes: str):
+        if not prefixes:
+            await cb_reply(ctx, "You need to provide at least one prefix.")
+            return
+
+        if len(prefixes) > MAX_PREFIXES:
+            await cb_reply(ctx, f"You can only have {MAX_PREFIXES} prefixes.")
+            return
+
+        if any(len(prefix) > MAX_PREFIX_LENGTH for prefix in prefixes):
+            await cb_reply(ctx, f"Prefixes can't be longer than {MAX_PREFIX_LENGTH} characters.")
+            return
+
+        await self.client.prefixes.set(ctx.guild.id, prefixes)
+        await cb_reply(ctx, f"My prefixes here are now: {', '.join(prefixes)}")
+
+    @_prefix.command(name="reset")
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def _prefix_reset(self, ctx):
+        await self.client.prefixes.reset(ctx.guild.id)
+        await cb_reply(ctx, f"My prefix here is now: {self.client.prefixes.default}")
+
+
+def setup(client):
+    client.add_cog(Prefixes(client))
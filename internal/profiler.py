@@ -0,0 +1,218 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import io
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional, Tuple
+
+import discord
+from discord.ext import commands
+from discord.ext.commands import check
+
+from utils import bot_owner, cb_reply, e_reply, plural
+
+# Frames are (file, line, function).
+Frame = Tuple[str, int, str]
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the stack of one thread every ``interval`` seconds until stopped.
+    Nothing is recorded when no profile is running as the thread doesn't exist.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="rick-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.elapsed = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.started = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            # Outermost first, like a flame graph.
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+        self.elapsed = time.perf_counter() - self.started
+
+    def stop(self):
+        self._stop_event.set()
+
+    def report(self, limit: int = 40) -> str:
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                own[stack[-1][::2]] += count
+            # A recursive function only counts once per sample.
+            for function in {frame[::2] for frame in stack}:
+                total[function] += count
+
+        def table(title: str, counter: Counter):
+            lines = [title, f"{'samples':>8} {'%':>6}  function"]
+            for (filename, name), count in counter.most_common(limit):
+                lines.append(f"{count:>8} {count / self.samples:>6.1%}  {name} ({filename})")
+            return lines
+
+        lines = [
+            f"{self.samples} samples over {self.elapsed:.1f}s, every {self.interval * 1000:.1f}ms",
+            "",
+            *table("Time spent in the function itself:", own),
+            "",
+            *table("Time spent in the function and what it called:", total),
+        ]
+        return "\n".join(lines) + "\n"
+
+    def folded(self) -> str:
+        """
+        Stacks in the folded format flamegraph.pl and speedscope read.
+        """
+        return "\n".join(
+            ";".join(f"{name} ({filename}:{lineno})" for filename, lineno, name in stack) + f" {count}"
+            for stack, count in self.stacks.items()
+        ) + "\n"
+
+
+class Profiler(commands.Cog):
+    _hide_from_help = True
+
+    def __init__(self, client):
+        self.client = client
+        self.sampler: Optional[Sampler] = None
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def cog_unload(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @commands.group(name="profile", invoke_without_command=True)
+    @check(bot_owner)
+    async def _profile(self, ctx):
+        await cb_reply(ctx, f"Use {ctx.clean_prefix}profile cpu, memory, memory stop or caches")
+
+    @_profile.command(name="cpu")
+    @check(bot_owner)
+    async def _profile_cpu(self, ctx, seconds: float = 10, interval_ms: float = 5):
+        if self.sampler is not None:
+            await cb_reply(ctx, "A profile is already running.")
+            return
+
+        seconds = min(max(seconds, 1), 300)
+        # Commands run on the event loop's thread, that is what gets sampled.
+        self.sampler = Sampler(threading.get_ident(), max(interval_ms, 1) / 1000)
+        await cb_reply(ctx, f"Profiling the event loop for {plural(seconds, 'second')}...")
+        try:
+            self.sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            sampler, self.sampler = self.sampler, None
+            sampler.stop()
+            await self.client.loop.run_in_executor(None, sampler.join)
+
+        report, folded = await self.client.loop.run_in_executor(None, lambda: (sampler.report(), sampler.folded()))
+        await ctx.reply(
+            f"Sampled the event loop {plural(sampler.samples, 'time')} in {sampler.elapsed:.1f}s.",
+            files=[
+                discord.File(io.BytesIO(report.encode()), "profile.txt"),
+                discord.File(io.BytesIO(folded.encode()), "profile.folded"),
+            ],
+        )
+
+    @_profile.group(name="memory", invoke_without_command=True)
+    @check(bot_owner)
+    async def _profile_memory(self, ctx, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(frames, 1))
+            self.snapshot = tracemalloc.take_snapshot()
+            await cb_reply(
+                ctx,
+                "Started tracing memory, run this again to see what changed and "
+                f"{ctx.clean_prefix}profile memory stop to stop tracing.",
+            )
+            return
+
+        def compare():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+            stats = snapshot.compare_to(self.snapshot, "lineno")
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [
+                f"Traced: {current / 1024 / 1024:.1f}MB now, {peak / 1024 / 1024:.1f}MB at most",
+                "",
+                "Largest changes since the last snapshot:",
+                *(str(stat) for stat in stats[:50]),
+                "",
+                "Largest allocations:",
+                *(str(stat) for stat in snapshot.statistics("lineno")[:50]),
+            ]
+            return snapshot, "\n".join(lines) + "\n"
+
+        self.snapshot, report = await self.client.loop.run_in_executor(None, compare)
+        await ctx.reply(
+            "Compared with the last snapshot.",
+            file=discord.File(io.BytesIO(report.encode()), "memory.txt"),
+        )
+
+    @_profile_memory.command(name="stop")
+    @check(bot_owner)
+    async def _profile_memory_stop(self, ctx):
+        if not tracemalloc.is_tracing():
+            await cb_reply(ctx, "Memory isn't being traced.")
+            return
+        tracemalloc.stop()
+        self.snapshot = None
+        await cb_reply(ctx, "Stopped tracing memory.")
+
+    @_profile.command(name="caches")
+    @check(bot_owner)
+    async def _profile_caches(self, ctx):
+        client = self.client
+        view_store = getattr(client._connection, "_view_store", None)
+        sizes = [
+            ("guilds", len(client.guilds)),
+            ("members", sum(len(guild.members) for guild in client.guilds)),
+            ("users", len(client.users)),
+            ("messages", len(client.cached_messages)),
+            ("active views", len(getattr(view_store, "_views", ()))),
+            ("tracked views", len(client.views)),
+            ("extensions", len(client.extensions)),
+            ("deferred extensions", len(client.lazy.pending)),
+            ("modules", len(sys.modules)),
+            ("prefixes", len(client.prefixes.cache)),
+            ("help pages", len(client.help_cache.pages)),
+            ("web responses", len(client.web.cache)),
+            ("deleted messages", len(client.outbound.deleted)),
+            ("outbound queues", len(client.outbound.queues)),
+            ("scheduled jobs", len(client.scheduler)),
+            ("error groups", len(client.errors.groups())),
+        ]
+        sizes.extend(
+            (f"db {name}", stats["size"]) for name, stats in client.db.cache_stats().items()
+        )
+        width = max(len(name) for name, _ in sizes)
+        await e_reply(ctx, "```\n" + "\n".join(f"{name:<{width}} {size:,}" for name, size in sizes) + "\n```")
+
+
+def setup(client):
+    client.add_cog(Profiler(client))
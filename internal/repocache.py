@@ -0,0 +1,253 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+from git.repo.base import Repo
+from git.exc import GitCommandError
+from contextlib import contextmanager
+from os.path import exists, join
+from typing import Dict, NamedTuple, Optional
+import threading
+import hashlib
+import shutil
+import json
+import time
+import re
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the cache can't be shared between processes.
+    fcntl = None
+
+from utils import rmtree_error
+
+FULL_COMMIT = re.compile(r"[0-9a-f]{40}")
+
+# What git says when a commit or branch isn't on the remote, the mirror itself is fine.
+MISSING_REF = ("couldn't find remote ref", "not our ref", "no such remote ref", "unadvertised object")
+
+
+class Snapshot(NamedTuple):
+    url: str
+    commit: str
+    path: str
+
+
+class RepoCache:
+    """
+    A content addressed cache of cog repositories.
+
+    Every repo gets a shallow mirror under ``mirrors/`` that is updated with
+    incremental fetches, and every commit that gets installed is exported once
+    to ``snapshots/{url key}-{commit}``. Snapshots are never modified so they
+    can be shared between installs. Once snapshots and mirrors together use more
+    than ``max_size`` bytes snapshots are evicted least recently used first, and
+    a repo's mirror goes with its last snapshot.
+
+    The cache can be shared between processes, like the clusters of one bot.
+    They take turns with a lock on ``index.lock`` and read the index again
+    when they get it. All of the methods block, run them in the executor.
+    """
+
+    def __init__(self, root: str = "./cache", max_size: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_size = max_size
+        self.mirrors = join(root, "mirrors")
+        self.snapshots = join(root, "snapshots")
+        self.index_path = join(root, "index.json")
+        self.lock_path = join(root, "index.lock")
+
+        self._lock = threading.Lock()
+
+        os.makedirs(self.mirrors, exist_ok=True)
+        os.makedirs(self.snapshots, exist_ok=True)
+        # Snapshot names and mirror keys to their entries and sizes.
+        self.index: Dict[str, dict] = {}
+        self.mirror_sizes: Dict[str, int] = {}
+        self._load_index()
+
+    @staticmethod
+    def key(url: str) -> str:
+        url = url.strip().rstrip("/")
+        if url.endswith(".git"):
+            url = url[:-4]
+        return hashlib.sha1(url.lower().encode()).hexdigest()[:16]
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.index.values()) + sum(self.mirror_sizes.values())
+
+    def fetch(self, url: str, commit: Optional[str] = None, *, offline: bool = False) -> Snapshot:
+        """
+        Returns a snapshot of ``url`` at ``commit``, or at the remote HEAD if no
+        commit is given. Only goes to the network when the snapshot isn't cached,
+        with ``offline`` the newest cached snapshot is used instead.
+        """
+        with self._locked():
+            if commit is not None:
+                commit = commit.lower()
+                snapshot = self._lookup(url, commit)
+                if snapshot is not None:
+                    return snapshot
+
+            if offline:
+                snapshot = self._lookup(url, commit)
+                if snapshot is None:
+                    raise LookupError(f"{url} has no cached snapshot.")
+                return snapshot
+
+            if commit is not None and not FULL_COMMIT.fullmatch(commit):
+                # Remotes only hand out commits by their full hash.
+                raise ValueError(f"{commit} isn't cached, pinned commits need the full hash.")
+
+            repo = self._update_mirror(url, commit)
+            return self._export(url, repo, repo.head.commit.hexsha)
+
+    def clear(self):
+        with self._locked():
+            for name in list(self.index):
+                self._remove(name)
+            self._save_index()
+
+    # <--- Internals --->
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have changed it since it was last read.
+                self._load_index()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        self.index, self.mirror_sizes = {}, {}
+        if not exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, json.decoder.JSONDecodeError):
+            return
+        if "snapshots" not in index:
+            # Written before mirrors were counted.
+            index = {"snapshots": index, "mirrors": {}}
+
+        # Drop entries for snapshots and mirrors that were deleted by hand.
+        self.index = {
+            name: entry for name, entry in index["snapshots"].items() if exists(join(self.snapshots, name))
+        }
+        self.mirror_sizes = {
+            key: size for key, size in index["mirrors"].items() if exists(join(self.mirrors, key))
+        }
+
+    def _save_index(self):
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"snapshots": self.index, "mirrors": self.mirror_sizes}, f)
+        os.replace(temp_path, self.index_path)
+
+    def _lookup(self, url: str, commit: Optional[str]) -> Optional[Snapshot]:
+        key = self.key(url)
+        matches = [
+            (name, entry) for name, entry in self.index.items()
+            if name.startswith(f"{key}-") and (commit is None or entry["commit"].startswith(commit))
+        ]
+        if not matches:
+            return None
+
+        name, entry = max(matches, key=lambda match: match[1]["fetched"])
+        entry["used"] = time.time()
+        self._save_index()
+        return Snapshot(entry["url"], entry["commit"], join(self.snapshots, name))
+
+    @staticmethod
+    def _missing_ref(error: GitCommandError) -> bool:
+        message = str(error.stderr).lower()
+        return any(text in message for text in MISSING_REF)
+
+    def _update_mirror(self, url: str, commit: Optional[str]) -> Repo:
+        key = self.key(url)
+        mirror_path = join(self.mirrors, key)
+
+        if exists(join(mirror_path, ".git")):
+            repo = Repo(mirror_path)
+            try:
+                if commit is None:
+                    repo.remotes.origin.fetch(depth=1)
+                else:
+                    repo.remotes.origin.fetch(commit, depth=1)
+                repo.git.reset("--hard", "FETCH_HEAD")
+                self.mirror_sizes[key] = self._disk_size(mirror_path)
+                return repo
+            except GitCommandError as error:
+                if self._missing_ref(error):
+                    # The commit isn't on the remote, a new clone wouldn't have it either.
+                    raise
+                # A broken or diverged mirror, start again from a fresh clone.
+                shutil.rmtree(mirror_path, onerror=rmtree_error)
+                self.mirror_sizes.pop(key, None)
+
+        repo = Repo.clone_from(url, mirror_path, depth=1)
+        if commit is not None:
+            repo.remotes.origin.fetch(commit, depth=1)
+            repo.git.reset("--hard", "FETCH_HEAD")
+        self.mirror_sizes[key] = self._disk_size(mirror_path)
+        return repo
+
+    def _export(self, url: str, repo: Repo, commit: str) -> Snapshot:
+        name = f"{self.key(url)}-{commit}"
+        path = join(self.snapshots, name)
+
+        if not exists(path):
+            temp_path = f"{path}.tmp"
+            if exists(temp_path):
+                shutil.rmtree(temp_path, onerror=rmtree_error)
+            shutil.copytree(repo.working_tree_dir, temp_path, ignore=shutil.ignore_patterns(".git"))
+            os.replace(temp_path, path)
+
+        now = time.time()
+        self.index[name] = {
+            "url": url,
+            "commit": commit,
+            "size": self._disk_size(path),
+            "fetched": now,
+            "used": now,
+        }
+        self._evict(keep=name)
+        self._save_index()
+        return Snapshot(url, commit, path)
+
+    def _evict(self, keep: str):
+        by_age = sorted(self.index, key=lambda name: self.index[name]["used"])
+        for name in by_age:
+            if self.size <= self.max_size:
+                break
+            if name != keep:
+                self._remove(name)
+
+    def _remove(self, name: str):
+        entry = self.index.pop(name)
+        shutil.rmtree(join(self.snapshots, name), onerror=rmtree_error)
+
+        # The mirror is only worth keeping while a snapshot of the repo is.
+        key = self.key(entry["url"])
+        if not any(other.startswith(f"{key}-") for other in self.index):
+            self.mirror_sizes.pop(key, None)
+            mirror_path = join(self.mirrors, key)
+            if exists(mirror_path):
+                shutil.rmtree(mirror_path, onerror=rmtree_error)
+
+    @staticmethod
+    def _disk_size(path: str) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                total += os.path.getsize(join(dirpath, filename))
+        return total
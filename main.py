@@ -5,7 +5,8 @@ All rights reserved.
 
 import logging
 
-from core import RickBot
+from core import RickBot, ShardedRickBot, ClusterManager
+from core.config import config_manager
 
 logging.basicConfig(
     level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
@@ -15,4 +16,11 @@ discordLogger.setLevel(logging.WARNING)
 
 
 if __name__ == "__main__":
-    RickBot().run()
+    mode = config_manager.current.cluster.mode.lower()
+
+    if mode == "cluster":
+        ClusterManager.from_config(config_manager.current).run()
+    elif mode == "sharded":
+        ShardedRickBot().run()
+    else:
+        RickBot().run()
@@ -0,0 +1,4 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
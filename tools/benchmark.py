@@ -0,0 +1,214 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+
+Measures how many messages RickBot handles per second.
+
+A real RickBot, with every installed extension, is given fake guilds, channels
+and members and a stand-in for the HTTP client, then messages are passed to
+on_message in different mixes. Run it from the folder rickconfig.ini is in:
+
+    python -m tools.benchmark --messages 5000 --output before.json
+    python -m tools.benchmark --messages 5000 --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import discord
+from discord.ext import commands
+
+from core import RickBot
+
+from .fakes import FakeHTTP, FakeWorld, bench_config, prepare, shutdown
+
+# How often each kind of message is picked, relative to the others.
+MIXES: Dict[str, Dict[str, int]] = {
+    "chatter": {"chatter": 1},
+    "command": {"command": 1},
+    "help": {"help": 1},
+    "error": {"error": 1},
+    "mixed": {"chatter": 70, "command": 20, "help": 5, "error": 5},
+}
+
+CHATTER = (
+    "wubba lubba dub dub",
+    "has anyone seen the new episode",
+    "https://example.com/some/long/link?with=query",
+    "lol",
+    "I'm pickle rick!",
+)
+
+
+class Benchmark(commands.Cog):
+    _hide_from_help = True
+
+    @commands.command(name="benchping")
+    async def _ping(self, ctx):
+        await ctx.reply("pong")
+
+    @commands.command(name="benchfail")
+    async def _fail(self, ctx):
+        raise RuntimeError("benchmark error")
+
+
+def content_for(kind: str, prefix: str) -> str:
+    if kind == "chatter":
+        return random.choice(CHATTER)
+    if kind == "command":
+        return f"{prefix}benchping"
+    if kind == "help":
+        return f"{prefix}help"
+    return f"{prefix}benchfail"
+
+
+def make_messages(world: FakeWorld, mix: Dict[str, int], count: int) -> List[discord.Message]:
+    kinds = random.choices(list(mix), weights=list(mix.values()), k=count)
+    prefix = world.bot.config.rick.prefix
+    return [
+        world.message(random.choice(world.channels), content_for(kind, prefix), random.choice(world.members))
+        for kind in kinds
+    ]
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_mix(bot: RickBot, world: FakeWorld, http: FakeHTTP, mix: Dict[str, int], count: int, warmup: int) -> dict:
+    for message in make_messages(world, mix, warmup):
+        await bot.on_message(message)
+
+    messages = make_messages(world, mix, count)
+    sends_before = http.sends()
+    latencies = []
+    started = time.perf_counter()
+    for message in messages:
+        start = time.perf_counter()
+        await bot.on_message(message)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    sends = http.sends() - sends_before
+
+    # Allocations are measured separately, tracing them slows everything down.
+    messages = make_messages(world, mix, min(count, 1000))
+    peaks = []
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        for message in messages:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await bot.on_message(message)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    retained = (sys.getallocatedblocks() - blocks) / len(messages)
+
+    return {
+        "messages": count,
+        "seconds": elapsed,
+        "messages_per_second": count / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "peak_bytes_per_message": statistics.fmean(peaks),
+        "retained_blocks_per_message": retained,
+        "sends": sends,
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, previous: dict):
+    print(f"\nCompared with {previous.get('commit', 'unknown')}:")
+    for name, result in results["results"].items():
+        before = previous.get("results", {}).get(name)
+        if before is None:
+            continue
+        throughput = result["messages_per_second"] / before["messages_per_second"] - 1
+        p99 = result["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        print(f"  {name:<8} {throughput:+7.1%} msgs/s, {p99:+7.1%} p99")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how many messages RickBot handles per second.")
+    parser.add_argument("--messages", type=int, default=2000, help="messages timed per mix")
+    parser.add_argument("--warmup", type=int, default=200, help="messages sent before timing each mix")
+    parser.add_argument("--mixes", default=",".join(MIXES), help=f"which mixes to run, out of {', '.join(MIXES)}")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--channels", type=int, default=5, help="channels per guild")
+    parser.add_argument("--members", type=int, default=50, help="members per guild")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake HTTP client takes to answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON file from an earlier run to compare with")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    bot = RickBot(config=bench_config())
+    bot.add_cog(Benchmark())
+    http = FakeHTTP(args.latency)
+    world = FakeWorld(bot, guilds=args.guilds, channels=args.channels, members=args.members)
+
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "discord": discord.__version__,
+        "time": time.time(),
+        "guilds": args.guilds,
+        "channels": args.guilds * args.channels,
+        "members": args.guilds * args.members,
+        "results": {},
+    }
+
+    async def run():
+        await prepare(bot, http)
+        for name in args.mixes.split(","):
+            result = await run_mix(bot, world, http, MIXES[name.strip()], args.messages, args.warmup)
+            results["results"][name.strip()] = result
+            print(
+                f"{name:<8} {result['messages_per_second']:>9.0f} msgs/s  p50 {result['p50_ms']:.3f}ms  "
+                f"p99 {result['p99_ms']:.3f}ms  {result['peak_bytes_per_message']:.0f}B peak/msg  "
+                f"{result['sends']} sends"
+            )
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.run_until_complete(shutdown(bot))
+        loop.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import datetime
+import itertools
+from dataclasses import replace
+from typing import Any, Dict, List, Optional
+
+import discord
+
+from core import RickBot
+from core.config import ConfigManager
+
+BOT_ID = 100000000000000001
+OWNER_ID = 100000000000000002
+
+_snowflakes = itertools.count(200000000000000000)
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+def timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def user_data(user_id: int, name: str, *, bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": name, "discriminator": "0001", "avatar": None, "bot": bot}
+
+
+class FakeHTTP:
+    """
+    Stands in for ``bot.http``. Sends and edits are recorded and answered with
+    a made up message, anything else returns an empty payload.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        # Seconds to wait before answering, like a round trip to discord.
+        self.latency = latency
+        self.requests: List[Dict[str, Any]] = []
+        self.user_agent = "RickBot benchmark"
+
+    def _record(self, method: str, channel_id: Any, args: tuple, kwargs: dict) -> dict:
+        params = kwargs.get("params")
+        payload = getattr(params, "payload", None) or {}
+        content = kwargs.get("content", payload.get("content"))
+        if content is None and args and isinstance(args[0], str):
+            content = args[0]
+        self.requests.append({"method": method, "channel_id": int(channel_id), "content": content})
+        return {
+            "id": str(snowflake()),
+            "channel_id": str(channel_id),
+            "author": user_data(BOT_ID, "Rick", bot=True),
+            "content": content or "",
+            "timestamp": timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+
+    async def _answer(self, method: str, channel_id: Any, args: tuple, kwargs: dict) -> dict:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._record(method, channel_id, args, kwargs)
+
+    async def send_message(self, channel_id, *args, **kwargs):
+        return await self._answer("send_message", channel_id, args, kwargs)
+
+    async def send_files(self, channel_id, *args, **kwargs):
+        return await self._answer("send_files", channel_id, args, kwargs)
+
+    async def edit_message(self, channel_id, message_id, *args, **kwargs):
+        return await self._answer("edit_message", channel_id, args, kwargs)
+
+    def __getattr__(self, name: str):
+        async def request(*args, **kwargs):
+            self.requests.append({"method": name, "channel_id": None, "content": None})
+            return {}
+        return request
+
+    def sends(self) -> int:
+        return sum(1 for request in self.requests if request["method"] in ("send_message", "send_files"))
+
+    async def close(self):
+        pass
+
+
+def bench_config(manager: Optional[ConfigManager] = None) -> ConfigManager:
+    """
+    The config in rickconfig.ini with nothing that leaves the process: the
+    memory database, no metrics server or gateway recording, and send limits
+    that never throttle.
+    """
+    manager = manager or ConfigManager()
+    current = manager.current
+    manager.current = replace(
+        current,
+        rick=replace(current.rick, token="benchmark", owner=OWNER_ID, hot_reload=False, lazy_load=False),
+        mongo=replace(current.mongo, backend="memory"),
+        metrics=replace(current.metrics, enabled=False),
+        recorder=replace(current.recorder, enabled=False),
+        outbound=replace(current.outbound, channel_rate=10 ** 9, channel_per=1.0, global_rate=10 ** 9),
+    )
+    return manager
+
+
+class FakeWorld:
+    """
+    Guilds, channels and members added to a bot's state as if the gateway had
+    sent them, and messages from those members.
+    """
+
+    def __init__(self, bot: RickBot, *, guilds: int = 10, channels: int = 5, members: int = 50):
+        self.bot = bot
+        self.state = bot._connection
+        self.state.user = discord.ClientUser(state=self.state, data=user_data(BOT_ID, "Rick", bot=True))
+
+        self.guilds: List[discord.Guild] = []
+        self.channels: List[discord.TextChannel] = []
+        self.members: List[dict] = []
+
+        for number in range(guilds):
+            guild_id = snowflake()
+            member_data = [
+                {"user": user_data(BOT_ID, "Rick", bot=True), "roles": [], "joined_at": timestamp(), "deaf": False, "mute": False},
+                {"user": user_data(OWNER_ID, "Owner"), "roles": [], "joined_at": timestamp(), "deaf": False, "mute": False},
+            ]
+            for index in range(members):
+                member_data.append({
+                    "user": user_data(snowflake(), f"member{index}"),
+                    "roles": [],
+                    "joined_at": timestamp(),
+                    "deaf": False,
+                    "mute": False,
+                })
+            guild = self.state._add_guild_from_data({
+                "id": str(guild_id),
+                "name": f"guild{number}",
+                # Owning the guild gives the bot every permission.
+                "owner_id": str(BOT_ID),
+                "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0,
+                           "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+                "channels": [
+                    {"id": str(snowflake()), "type": 0, "name": f"channel{index}", "position": index,
+                     "permission_overwrites": [], "nsfw": False, "parent_id": None}
+                    for index in range(channels)
+                ],
+                "members": member_data,
+                "member_count": len(member_data),
+                "emojis": [],
+                "stickers": [],
+                "features": [],
+            })
+            self.guilds.append(guild)
+            self.channels.extend(guild.text_channels)
+            self.members.extend(member_data[1:])
+
+    def message(self, channel: discord.TextChannel, content: str, member: Optional[dict] = None) -> discord.Message:
+        member = member or self.members[1]
+        return discord.Message(state=self.state, channel=channel, data={
+            "id": str(snowflake()),
+            "channel_id": str(channel.id),
+            "guild_id": str(channel.guild.id),
+            "author": member["user"],
+            "member": {key: value for key, value in member.items() if key != "user"},
+            "content": content,
+            "timestamp": timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        })
+
+
+async def prepare(bot: RickBot, http: FakeHTTP):
+    """
+    The parts of ``RickBot.start`` that don't need discord.
+    """
+    bot.http = bot._connection.http = http
+    bot.db.connect()
+    bot.prefixes.collection = bot.db["prefixes"]
+    bot.outbound.start()
+    await bot.views.start()
+    await bot.scheduler.start()
+    await bot.loader.prepare()
+
+
+async def shutdown(bot: RickBot):
+    """
+    Closes the bot like it would be after running, then cancels and waits for
+    whatever its services left running so the loop can be closed cleanly.
+    """
+    await bot.close()
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
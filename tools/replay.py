@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+
+Replays a gateway recording into a RickBot without connecting to discord.
+
+Record with [RECORDER] enabled in rickconfig.ini, then run it from the folder
+rickconfig.ini is in at real speed, N times faster or as fast as possible:
+
+    python -m tools.replay recordings/gateway-20220101-120000.rec --speed 10
+    python -m tools.replay recordings/gateway-20220101-120000.rec --speed max --output replay.json
+
+Everything rick sends goes to the same HTTP stand-in as tools.benchmark.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+
+from core import RickBot
+from core.recorder import read_recording
+
+from .fakes import FakeHTTP, bench_config, prepare, shutdown
+
+log = logging.getLogger("rickbot")
+
+
+async def settle(timeout: float = 30):
+    """
+    Waits for the tasks the replayed events started.
+    """
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+    if pending:
+        await asyncio.wait(pending, timeout=timeout)
+
+
+async def replay(bot: RickBot, http: FakeHTTP, path: str, speed: float) -> dict:
+    await prepare(bot, http)
+    parsers = bot._connection.parsers
+
+    events: Counter = Counter()
+    failed: Counter = Counter()
+    unknown: Counter = Counter()
+    behind = 0.0
+
+    started = time.perf_counter()
+    for offset, event, data in read_recording(path):
+        if speed:
+            delay = started + offset / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                behind = max(behind, -delay)
+
+        parser = parsers.get(event)
+        if parser is None:
+            unknown[event] += 1
+            continue
+        events[event] += 1
+        try:
+            parser(data)
+        except Exception:
+            failed[event] += 1
+            log.debug(f"Replaying {event} failed", exc_info=True)
+
+        # Let the handlers the event dispatched run, like between gateway messages.
+        await asyncio.sleep(0)
+
+    await settle()
+    elapsed = time.perf_counter() - started
+
+    total = sum(events.values())
+    return {
+        "events": total,
+        "seconds": elapsed,
+        "events_per_second": total / elapsed if elapsed else 0.0,
+        "max_behind_seconds": behind,
+        "sends": http.sends(),
+        "requests": len(http.requests),
+        "by_event": dict(events.most_common()),
+        "failed": dict(failed),
+        "unknown": dict(unknown),
+        "commands": {name: metrics.count for name, metrics in bot.metrics.commands.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a gateway recording into RickBot offline.")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", default="1", help="how many times faster than recorded, or max")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake HTTP client takes to answer")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    speed = 0.0 if args.speed.lower() == "max" else float(args.speed)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    bot = RickBot(config=bench_config())
+    http = FakeHTTP(args.latency)
+    try:
+        results = loop.run_until_complete(replay(bot, http, args.recording, speed))
+    finally:
+        loop.run_until_complete(shutdown(bot))
+        loop.close()
+
+    print(
+        f"Replayed {results['events']} events in {results['seconds']:.2f}s "
+        f"({results['events_per_second']:.0f}/s), at most {results['max_behind_seconds']:.3f}s behind, "
+        f"{results['sends']} messages sent"
+    )
+    for event, count in results["failed"].items():
+        print(f"  {count} {event} events failed")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,3 +9,5 @@ from .sources import *
 from .useful import *
 from .views import *
 from .errors import *
+from .cache import *
+from .progress import *
@@ -6,15 +6,137 @@ All rights reserved.
 import discord
 from discord.ext import commands
 
+import asyncio
+import hashlib
 import traceback
-import sys
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from .messages import cb_reply
 
 ignored = (commands.CommandNotFound, )
 log = logging.getLogger("rickbot")
 
+# How many of the innermost frames identify where an error came from.
+FINGERPRINT_FRAMES = 5
+
+
+def fingerprint(error: BaseException) -> str:
+    """
+    Identifies an error by its type and where it was raised, so the same bug
+    hit again with different arguments counts as a repeat. Reads no source.
+    """
+    frames = [
+        f"{frame.f_code.co_filename}:{lineno}:{frame.f_code.co_name}"
+        for frame, lineno in traceback.walk_tb(error.__traceback__)
+    ][-FINGERPRINT_FRAMES:]
+    key = "|".join([f"{type(error).__module__}.{type(error).__qualname__}", *frames])
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def location(error: BaseException) -> str:
+    last = None
+    for frame, lineno in traceback.walk_tb(error.__traceback__):
+        last = f"{frame.f_code.co_filename}:{lineno} in {frame.f_code.co_name}"
+    return last or "unknown"
+
+
+class ErrorGroup:
+    """
+    Every occurrence of one error, by fingerprint.
+    """
+
+    __slots__ = (
+        "fingerprint", "type", "message", "location", "context",
+        "count", "first_seen", "last_seen", "last_logged", "suppressed", "traceback",
+    )
+
+    def __init__(self, key: str, error: BaseException, context: str):
+        self.fingerprint = key
+        self.type = type(error).__name__
+        self.message = str(error)
+        self.location = location(error)
+        self.context = context
+        self.count = 0
+        self.first_seen = self.last_seen = time.time()
+        self.last_logged = 0.0
+        self.suppressed = 0
+        # Formatted off the loop the first time the group is logged.
+        self.traceback: Optional[str] = None
+
+
+class ErrorPipeline:
+    """
+    Where unhandled errors go, available as ``bot.errors``.
+
+    ``report`` is cheap and never blocks: errors are grouped by fingerprint and
+    a group is only logged once every ``log_interval`` seconds with how many
+    times it happened since. Formatting the traceback and writing it happen in
+    a background thread. The ``max_groups`` most recent groups are kept.
+    """
+
+    def __init__(self, *, max_groups: int = 100, log_interval: float = 60):
+        self.max_groups = max_groups
+        self.log_interval = log_interval
+        self._groups: "OrderedDict[str, ErrorGroup]" = OrderedDict()
+        # One thread keeps the log in order and doesn't take the loop's executor.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rick-errors")
+
+        self.reported = 0
+        self.logged = 0
+
+    def report(self, error: BaseException, context: str):
+        self.reported += 1
+        key = fingerprint(error)
+
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = ErrorGroup(key, error, context)
+            if len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        else:
+            self._groups.move_to_end(key)
+            group.message = str(error)
+            group.context = context
+
+        group.count += 1
+        group.last_seen = time.time()
+
+        if group.last_seen - group.last_logged < self.log_interval:
+            group.suppressed += 1
+            return
+
+        repeats, group.suppressed = group.suppressed, 0
+        group.last_logged = group.last_seen
+        try:
+            asyncio.get_event_loop().run_in_executor(self._executor, self._write, group, error, repeats)
+        except RuntimeError:
+            # The executor was shut down, the bot is closing.
+            pass
+
+    def _write(self, group: ErrorGroup, error: BaseException, repeats: int):
+        text = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        group.traceback = text
+        self.logged += 1
+        repeated = f" (repeated {repeats} times since it was last logged)" if repeats else ""
+        log.error(f"Ignoring exception in {group.context} [{group.fingerprint}]{repeated}\n{text}")
+
+    def groups(self) -> List[ErrorGroup]:
+        """
+        The kept groups, the most recent first.
+        """
+        return list(reversed(self._groups.values()))
+
+    def clear(self):
+        self._groups.clear()
+
+    def close(self):
+        # Let what is already queued be written.
+        self._executor.shutdown(wait=True)
+
 
 async def handle_error(ctx, error):
     if hasattr(ctx.command, 'on_error'):
@@ -49,7 +171,4 @@ async def handle_error(ctx, error):
         await ctx.message.reply("Please provide all the required arguments when using this command.", mention_author=False)
 
     else:
-        print('Ignoring exception in command {}:'.format(ctx.command), file=sys.stderr)
-        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
-        log.exception(f"{ctx.author} caused an error in {ctx.command}")  # exc_info=error
-        # critical(error, luna=True)
+        ctx.bot.errors.report(error, f"command {ctx.command} (by {ctx.author})")
@@ -10,7 +10,7 @@ from .embed import Embed
 
 
 async def cb_reply(ctx: commands.Context, content: str, mention: bool = False):
-    return await ctx.message.reply(embed=Embed(description=f"`{content}`").raw(), mention_author=mention)
+    return await ctx.reply(embed=Embed(description=f"`{content}`").raw(), mention_author=mention)
 
 
 async def cb_reply_edit(msg: discord.Message, content: str, mention: bool = False):
@@ -22,11 +22,11 @@ async def cb_send(ctx: commands.Context, content: str, mention: bool = False):
 
 
 async def e_reply(ctx: commands.Context, content: str, mention: bool = False):
-    return await ctx.message.reply(embed=Embed(description=content).raw(), mention_author=mention)
+    return await ctx.reply(embed=Embed(description=content).raw(), mention_author=mention)
 
 
 async def reply(ctx: commands.Context, content: str, mention: bool = False):
-    return await ctx.message.reply(content, mention_author=mention)
+    return await ctx.reply(content, mention_author=mention)
 
 
 async def send(ctx: commands.Context, content: str, mention: bool = False):
@@ -0,0 +1,99 @@
+"""
+Copyright (c) 2022, Zach Lagden
+All rights reserved.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+import discord
+
+from .messages import cb_reply_edit
+
+
+class ProgressReporter:
+    """
+    Edits a status message with ``cb_reply_edit`` at most once every ``interval``
+    seconds, made with ``ctx.progress``.
+
+    ``update`` never waits, when updates come faster than the interval only the
+    latest one is shown. ``finish`` always shows its content, after waiting out
+    the interval if it has to. Once the message is deleted nothing else is sent.
+    """
+
+    def __init__(
+        self,
+        message: discord.Message,
+        *,
+        interval: float = 1.5,
+        is_deleted: Optional[Callable[[int], bool]] = None
+    ):
+        self.message = message
+        self.interval = interval
+        self._is_deleted = is_deleted
+
+        self.pending: Optional[str] = None
+        self.edits = 0
+        self.collapsed = 0
+        self.cancelled = False
+        self._last_edit = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def deleted(self) -> bool:
+        return self._is_deleted is not None and self._is_deleted(self.message.id)
+
+    def update(self, content: str):
+        if self.cancelled:
+            return
+        if self.pending is not None:
+            self.collapsed += 1
+        self.pending = content
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(max(0.0, self._last_edit + self.interval - time.monotonic()))
+            await self._edit()
+        finally:
+            self._task = None
+
+    async def _edit(self):
+        content, self.pending = self.pending, None
+        if content is None or self.cancelled:
+            return
+        if self.deleted:
+            self.cancel()
+            return
+        try:
+            await cb_reply_edit(self.message, content)
+        except discord.NotFound:
+            self.cancel()
+        else:
+            self.edits += 1
+        finally:
+            self._last_edit = time.monotonic()
+
+    async def finish(self, content: str) -> Optional[discord.Message]:
+        """
+        Shows the final state, returns None if the message was deleted.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.cancelled:
+            return None
+        if self.pending is not None:
+            self.collapsed += 1
+        self.pending = content
+        await asyncio.sleep(max(0.0, self._last_edit + self.interval - time.monotonic()))
+        await self._edit()
+        return None if self.cancelled else self.message
+
+    def cancel(self):
+        self.cancelled = True
+        self.pending = None
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
@@ -5,10 +5,12 @@ All rights reserved.
 
 from __future__ import annotations
 
-from typing import Any, List
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
 
 import discord
-from discord.ext.menus import ListPageSource
+from discord.ext.menus import ListPageSource, PageSource as MenuPageSource
 
 
 class PageSource(ListPageSource):
@@ -17,3 +19,200 @@ class PageSource(ListPageSource):
 
     async def format_page(self, view: discord.ui.View, page: Any):
         return page
+
+
+class AsyncPageSource(MenuPageSource):
+    """
+    Pages fetched when they are first shown instead of all built up front.
+
+    Subclasses implement ``fetch_page``, which returns the entries of a page and
+    fewer than ``per_page`` of them on the last page. The total isn't known
+    until the last page has been fetched, ``get_max_pages`` is None until then.
+    While a page is shown the next one is fetched in the background, and the
+    ``cache_size`` most recently shown pages are kept already formatted.
+    ``close`` cancels whatever is still being fetched once it isn't shown anymore.
+    """
+
+    def __init__(self, *, per_page: int = 10, cache_size: int = 8, prefetch: bool = True):
+        self.per_page = per_page
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+
+        self._max_pages: Optional[int] = None
+        self._entries: "OrderedDict[int, List[Any]]" = OrderedDict()
+        self._rendered: "OrderedDict[int, Any]" = OrderedDict()
+        self._fetching: Dict[int, asyncio.Task] = {}
+        # Prefetches nobody is waiting on, kept so they aren't collected while running.
+        self._prefetching: Set[asyncio.Task] = set()
+
+    async def fetch_page(self, page_number: int) -> List[Any]:
+        raise NotImplementedError
+
+    def is_paginating(self) -> bool:
+        return True
+
+    def get_max_pages(self) -> Optional[int]:
+        return self._max_pages
+
+    def _remember(self, cache: OrderedDict, page_number: int, value: Any):
+        cache[page_number] = value
+        cache.move_to_end(page_number)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    async def _load(self, page_number: int) -> List[Any]:
+        entries = self._entries.get(page_number)
+        if entries is not None:
+            self._entries.move_to_end(page_number)
+            return entries
+
+        # The page being shown and its prefetch share one fetch.
+        task = self._fetching.get(page_number)
+        if task is None:
+            task = self._fetching[page_number] = asyncio.ensure_future(self.fetch_page(page_number))
+            task.add_done_callback(lambda _: self._fetching.pop(page_number, None))
+        entries = await asyncio.shield(task)
+
+        if len(entries) < self.per_page:
+            # The last page, or past it if there is nothing on it.
+            self._max_pages = page_number + 1 if entries or page_number == 0 else page_number
+        if entries or page_number == 0:
+            self._remember(self._entries, page_number, entries)
+        return entries
+
+    def _prefetch(self, page_number: int):
+        if not self.prefetch or page_number in self._entries or page_number in self._fetching:
+            return
+        if self._max_pages is not None and page_number >= self._max_pages:
+            return
+
+        async def fetch():
+            try:
+                await self._load(page_number)
+            except Exception:
+                # It's fetched again, and the error shown, if the page is opened.
+                pass
+
+        task = asyncio.ensure_future(fetch())
+        self._prefetching.add(task)
+        task.add_done_callback(self._prefetching.discard)
+
+    async def get_page(self, page_number: int) -> List[Any]:
+        if page_number < 0 or (self._max_pages is not None and page_number >= self._max_pages):
+            raise IndexError(page_number)
+
+        entries = await self._load(page_number)
+        if not entries and page_number > 0:
+            raise IndexError(page_number)
+
+        self._prefetch(page_number + 1)
+        return entries
+
+    async def render(self, view: discord.ui.View, page_number: int) -> Any:
+        """
+        The formatted page, from the cache if it was shown recently.
+        """
+        if page_number in self._rendered:
+            self._rendered.move_to_end(page_number)
+            self._prefetch(page_number + 1)
+            return self._rendered[page_number]
+
+        entries = await self.get_page(page_number)
+        value = await discord.utils.maybe_coroutine(self.format_page, view, entries)
+        self._remember(self._rendered, page_number, value)
+        return value
+
+    async def format_page(self, view: discord.ui.View, page: List[Any]):
+        return page
+
+    def close(self):
+        for task in (*self._prefetching, *self._fetching.values()):
+            task.cancel()
+
+
+class IteratorPageSource(AsyncPageSource):
+    """
+    Pages from an async iterator, only as much of it is read as has been shown.
+    """
+
+    def __init__(self, iterator: AsyncIterator[Any], **kwargs):
+        super().__init__(**kwargs)
+        self.iterator = iterator.__aiter__()
+        # An iterator can't go back, so what was read is kept for earlier pages.
+        self._read: List[Any] = []
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+
+    async def fetch_page(self, page_number: int) -> List[Any]:
+        start = page_number * self.per_page
+        end = start + self.per_page
+        async with self._lock:
+            while len(self._read) < end and not self._exhausted:
+                try:
+                    self._read.append(await self.iterator.__anext__())
+                except StopAsyncIteration:
+                    self._exhausted = True
+        return self._read[start:end]
+
+
+class CursorPageSource(AsyncPageSource):
+    """
+    Pages from a collection of ``bot.db``, a page at a time with skip and limit.
+
+    With ``range_key`` (a unique and sorted field, like ``_id``) the page after
+    one that was already fetched is found with a range on that key instead,
+    which stays fast however far the pages go. ``count`` gets the total up front
+    with ``count_documents`` so the number of pages is known from the start.
+    """
+
+    def __init__(
+        self,
+        collection,
+        filter: Optional[dict] = None,
+        *,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        range_key: Optional[str] = None,
+        projection: Optional[dict] = None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.collection = collection
+        self.filter = filter or {}
+        self.range_key = range_key
+        self.projection = projection
+        if range_key is not None:
+            direction = dict(sort or ()).get(range_key, 1)
+            self.sort = [(range_key, direction)]
+            self._operator = "$gt" if direction == 1 else "$lt"
+        else:
+            self.sort = sort
+
+        # The range key of the last entry on each fetched page.
+        self._last_keys: Dict[int, Any] = {}
+
+    async def count(self) -> int:
+        total = await self.collection.count_documents(self.filter)
+        self._max_pages = max(1, -(-total // self.per_page))
+        return total
+
+    async def fetch_page(self, page_number: int) -> List[Any]:
+        previous = self._last_keys.get(page_number - 1)
+        if self.range_key is not None and previous is not None:
+            entries = await self.collection.find(
+                {"$and": [self.filter, {self.range_key: {self._operator: previous}}]},
+                sort=self.sort,
+                limit=self.per_page,
+                projection=self.projection,
+            )
+        else:
+            entries = await self.collection.find(
+                self.filter,
+                sort=self.sort,
+                skip=page_number * self.per_page,
+                limit=self.per_page,
+                projection=self.projection,
+            )
+
+        if self.range_key is not None and entries:
+            self._last_keys[page_number] = entries[-1].get(self.range_key)
+        return entries
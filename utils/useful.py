@@ -7,14 +7,11 @@ import re
 import time
 import os
 from typing import Union
-from configparser import ConfigParser
-
-config = ConfigParser()
-config.read('./rickconfig.ini')
 
 
 def bot_owner(ctx):
-    return ctx.author.id == int(config.get("RICK", "owner"))
+    # Parsed once when the config is loaded, not per check.
+    return ctx.author.id == ctx.bot.config.rick.owner
 
 
 def rmtree_error(func, path, exc_info):
@@ -3,13 +3,37 @@ Copyright (c) 2022, Zach Lagden
 All rights reserved.
 """
 
-from typing import Optional
+import datetime
+import time
+from typing import Optional, Tuple
 
 import discord
 from discord.ext import commands
 
 from .sources import PageSource
 
+CUSTOM_ID_PREFIX = "rick"
+
+
+def encode_custom_id(view_type: str, key: str, action: str) -> str:
+    custom_id = f"{CUSTOM_ID_PREFIX}:{view_type}:{key}:{action}"
+    if len(custom_id) > 100:
+        raise ValueError(f"The custom_id {custom_id!r} is longer than discord allows, use a shorter key.")
+    return custom_id
+
+
+def decode_custom_id(custom_id: str) -> Optional[Tuple[str, str, str]]:
+    """
+    The view type, key and action of a custom_id from ``encode_custom_id``.
+    """
+    prefix, _, rest = custom_id.partition(":")
+    view_type, _, rest = rest.partition(":")
+    # Keys may have colons in them, actions can't.
+    key, _, action = rest.rpartition(":")
+    if prefix != CUSTOM_ID_PREFIX or not view_type or not key or not action:
+        return None
+    return view_type, key, action
+
 
 class Confirm(discord.ui.View):
     def __init__(self, timeout: int = 45):
@@ -49,15 +73,25 @@ class PaginatedView(discord.ui.View):
 
     async def send_initial_message(self, ctx: commands.Context):
         self._author_id = ctx.author.id
-        page = await self._source.get_page(self.current_page)
-        kwargs = await self._get_kwargs_from_page(page)
+        kwargs = await self._get_kwargs_for(self.current_page)
         return await ctx.reply(**kwargs)
 
+    async def _get_kwargs_for(self, page_number: int) -> dict:
+        render = getattr(self._source, "render", None)
+        if render is not None:
+            # Async sources keep recently shown pages already formatted.
+            return self._kwargs_from_value(await render(self, page_number))
+        page = await self._source.get_page(page_number)
+        return await self._get_kwargs_from_page(page)
+
     async def _get_kwargs_from_page(self, page) -> dict:
         value = await discord.utils.maybe_coroutine(self._source.format_page, self, page)
+        return self._kwargs_from_value(value)
+
+    def _kwargs_from_value(self, value) -> dict:
         kwargs: Optional[dict] = None
         if isinstance(value, dict):
-            kwargs = value
+            kwargs = dict(value)
         elif isinstance(value, str):
             kwargs = {"content": value, "embed": None}
         elif isinstance(value, discord.Embed):
@@ -66,16 +100,24 @@ class PaginatedView(discord.ui.View):
         return kwargs
 
     async def show_page(self, page_number: int, interaction: discord.Interaction):
-        page = await self._source.get_page(page_number)
+        kwargs = await self._get_kwargs_for(page_number)
         self.current_page = page_number
-        kwargs = await self._get_kwargs_from_page(page)
         await interaction.response.edit_message(**kwargs)
 
     async def show_checked_page(self, page_number: int, interaction: discord.Interaction) -> None:
         max_pages = self._source.get_max_pages()
         try:
-            if max_pages is None or max_pages > page_number >= 0:
-                # If it doesn't give maximum pages, it cannot be checked
+            if max_pages is None:
+                # The total isn't known yet, so there is no last page to go back to from
+                # the first one, and going past the end goes back to the start.
+                if page_number < 0:
+                    await interaction.response.defer()
+                    return
+                try:
+                    await self.show_page(page_number, interaction)
+                except IndexError:
+                    await self.show_page(0, interaction)
+            elif max_pages > page_number >= 0:
                 await self.show_page(page_number, interaction)
             elif page_number >= max_pages:
                 await self.show_page(0, interaction)
@@ -85,6 +127,18 @@ class PaginatedView(discord.ui.View):
             # An error happened that can be handled, so ignore it.
             pass
 
+    def _close_source(self):
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+
+    def stop(self):
+        super().stop()
+        self._close_source()
+
+    async def on_timeout(self):
+        self._close_source()
+
     @discord.ui.button(label="previous", style=discord.ButtonStyle.blurple)
     async def previous(self, _button: discord.ui.Button, interaction: discord.Interaction):
         await self.show_checked_page(self.current_page - 1, interaction)
@@ -97,3 +151,63 @@ class PaginatedView(discord.ui.View):
     @discord.ui.button(label="next", style=discord.ButtonStyle.blurple)
     async def next(self, _button: discord.ui.Button, interaction: discord.Interaction):
         await self.show_checked_page(self.current_page + 1, interaction)
+
+
+class PersistentView(discord.ui.View):
+    """
+    A view whose buttons keep working after a restart without staying in memory.
+
+    Subclasses set a short, unique ``view_type`` and are registered with
+    ``bot.views.register``. Every button's custom_id is ``rick:type:key:action``,
+    the action being the name of its callback. ``save`` stores ``state`` in the
+    ``views`` collection under the key, and a click builds a new view from it.
+    """
+
+    view_type: str = ""
+    # Seconds the state is kept after it was last saved, None keeps it forever.
+    ttl: Optional[float] = None
+
+    def __init__(self, bot, key: str, state: Optional[dict] = None):
+        super().__init__(timeout=None)
+        self.bot = bot
+        self.key = str(key)
+        self.state = state if state is not None else {}
+
+        for index, item in enumerate(self.children):
+            if getattr(item, "url", None) or not hasattr(item, "custom_id"):
+                continue
+            callback = getattr(item.callback, "func", None)
+            item.custom_id = encode_custom_id(self.view_type, self.key, callback.__name__ if callback else str(index))
+
+    @property
+    def document_id(self) -> str:
+        return f"{self.view_type}:{self.key}"
+
+    def find_item(self, action: str) -> Optional[discord.ui.Item]:
+        for item in self.children:
+            decoded = decode_custom_id(getattr(item, "custom_id", None) or "")
+            if decoded is not None and decoded[2] == action:
+                return item
+        return None
+
+    async def save(self):
+        document = {"state": self.state, "updated": time.time()}
+        if self.ttl is not None:
+            document["expires"] = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        await self.bot.db["views"].update_one({"_id": self.document_id}, {"$set": document}, upsert=True)
+
+    async def delete(self):
+        await self.bot.db["views"].delete_one({"_id": self.document_id})
+
+    @classmethod
+    async def load(cls, bot, key: str) -> Optional["PersistentView"]:
+        """
+        The view saved under ``key``, None if it was deleted or has expired.
+        """
+        document = await bot.db["views"].get(f"{cls.view_type}:{key}")
+        if document is None:
+            return None
+        expires = document.get("expires")
+        if expires is not None and expires <= datetime.datetime.utcnow():
+            return None
+        return cls(bot, key, document.get("state"))